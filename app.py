@@ -1,48 +1,168 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file
+import time
+_started = time.perf_counter()
+
+from flask import Flask, Response, g, render_template, request, redirect, url_for, send_file, jsonify
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-from PIL import Image
-import matplotlib.pyplot as plt
-from fpdf import FPDF
 import io
+import json
 import os
+import tempfile
+import hmac
 import cv2
 
+import config
+import metrics
+from nifti import analyze_nifti_volume, is_nifti_filename, nifti_suffix
+from lesions import label_lesions_2d, lesion_summary
+from mask_codec import pack_mask, unpack_mask
+from prediction_cache import PredictionCache, prediction_key
+from model_manager import BACKENDS, ModelManager
+from model_registry import ModelRegistry
+from tiling import TiledPredictor
+from prefilter import SliceFilter
+from uploads import AuditWriter, load_image, prepare_model_input
+from rendering import render_triptych
+from chart_atlas import ChartAtlas, chart_keys
+from artifact_store import ArtifactStore
+from jobs import DONE, FAILED, JobManager, JobQueueFull
+from reports import build_report, render_report_pdf
+from result_store import ResultStore
+
+startup_timings = {"imports": time.perf_counter() - _started}
+
 app = Flask(__name__)
 
-# Load the trained model
-model_path = "liver_tumor_segmentation_final.keras"
-model = load_model(model_path)
+# Each model version gets its own micro-batching engine, so concurrent requests share
+# forward passes; new versions are loaded and swapped in at runtime through /admin/models
+model_latency = metrics.Histogram('liver_model_inference_seconds', 'Model inference latency by model version.',
+                                  ('version',))
+model_registry = ModelRegistry(max_batch_size=config.INFERENCE_MAX_BATCH_SIZE,
+                               max_wait_ms=config.INFERENCE_MAX_WAIT_MS,
+                               warmup_batch_sizes=config.MODEL_WARMUP_BATCH_SIZES,
+                               latency_histogram=model_latency)
 
-def preprocess_image(image_path, target_size=(256, 256)):
-    image = Image.open(image_path)
-    if image is None:
-        raise ValueError("Image not found. Please check the path.")
-    
-    image = image.resize(target_size)
-    image = np.array(image) / 255.0
-    
-    if len(image.shape) == 3:
-        image = image[:, :, 0]
-    
-    image = np.expand_dims(image, axis=-1)
-    image = np.expand_dims(image, axis=0)
-    return image
+# The model (and TensorFlow) load in the background; /readyz reports when it can serve.
+# Only the registry holds the manager, so a retired model's weights can be freed
+model_path = {"tflite": config.TFLITE_MODEL_PATH, "server": config.MODEL_SERVER_SOCKET}.get(
+    config.INFERENCE_BACKEND, config.MODEL_PATH)
+initial_model = model_registry.register(ModelManager(model_path, version=config.MODEL_VERSION,
+                                                     warmup_batch_sizes=config.MODEL_WARMUP_BATCH_SIZES,
+                                                     backend=config.INFERENCE_BACKEND,
+                                                     num_threads=config.TFLITE_NUM_THREADS)).manager
+if config.MODEL_LOAD_MODE == "eager":
+    initial_model.load()
+elif config.MODEL_LOAD_MODE == "background":
+    initial_model.start()
+del initial_model
+
+# Blank (and, with a trained classifier, liver-free) slices get an empty mask without the model
+slice_filter = None
+if config.PREFILTER:
+    slice_filter = SliceFilter.load(config.PREFILTER_PATH) if config.PREFILTER_PATH else SliceFilter()
+
+# Full-resolution mode: overlapping tiles go through the same engine in batches
+tiled_predictor = TiledPredictor(model_registry.predict, tile_size=256,
+                                 overlap=config.TILE_OVERLAP, batch_size=config.TILE_BATCH_SIZE)
+
+# Repeat submissions of the same scan skip the model entirely. Besides the model
+# version, the key covers every setting that changes the mask, so a config change
+# never serves results computed under the old one
+prediction_cache = PredictionCache(max_bytes=config.PREDICTION_CACHE_MAX_BYTES,
+                                   disk_dir=config.PREDICTION_CACHE_DIR)
+prediction_settings = [config.INFERENCE_MODE]
+if config.INFERENCE_MODE == "tiled":
+    prediction_settings.append(f"overlap={config.TILE_OVERLAP}")
+prediction_settings.append(f"prefilter={slice_filter.fingerprint() if slice_filter is not None else 'off'}")
+prediction_settings = "/".join(prediction_settings)
+
+# Risk charts only depend on a few discrete buckets, so every variant is
+# rendered once and served from memory
+chart_atlas = ChartAtlas(config.RENDER_BACKEND)
+if config.CHART_ATLAS_PRERENDER:
+    chart_atlas.prerender()
+
+# Overlays and PDFs are kept per analysis so concurrent users never share files
+artifact_store = ArtifactStore(max_bytes=config.ARTIFACT_MAX_BYTES,
+                               ttl_seconds=config.ARTIFACT_TTL_SECONDS,
+                               spill_dir=config.ARTIFACT_SPILL_DIR)
+
+# Analyses run on a bounded worker pool; the HTML form and the JSON API both submit jobs
+job_manager = JobManager(max_workers=config.JOB_WORKERS,
+                         max_queue=config.JOB_QUEUE_SIZE,
+                         result_ttl_seconds=config.JOB_RESULT_TTL_SECONDS)
+
+# Every finished analysis is kept per patient so follow-up scans can be compared;
+# rows are written in batches by a background thread
+result_store = ResultStore(config.RESULT_DB_PATH, batch_size=config.RESULT_STORE_BATCH_SIZE,
+                           flush_interval=config.RESULT_STORE_FLUSH_SECONDS) if config.RESULT_DB_PATH else None
+
+# Uploads are analysed from memory; a copy is only written to disk for auditing
+audit_writer = AuditWriter(config.UPLOAD_DIR) if config.SAVE_UPLOADS else None
+
+# Metrics, exposed on /metrics in the Prometheus text format
+registry = metrics.Registry()
+http_requests = registry.counter('liver_http_requests_total', 'HTTP requests by endpoint, method and status.',
+                                 ('endpoint', 'method', 'status'))
+http_errors = registry.counter('liver_http_errors_total', 'HTTP responses with a 5xx status.', ('endpoint',))
+http_latency = registry.histogram('liver_http_request_duration_seconds', 'HTTP request latency.', ('endpoint',))
+http_in_flight = registry.gauge('liver_http_requests_in_flight', 'HTTP requests currently being handled.')
+stage_timer = metrics.StageTimer(registry.histogram('liver_stage_duration_seconds',
+                                                   'Time spent in each analysis stage.', ('stage',)))
+analysis_failures = registry.counter('liver_analysis_failures_total', 'Analyses that raised an error.')
+prediction_cache_lookups = registry.counter('liver_prediction_cache_lookups_total',
+                                            'Prediction cache lookups by result.', ('result',))
+prefilter_decisions = registry.counter('liver_prefilter_decisions_total',
+                                      'Pre-filter decisions by result (model or skipped).', ('result',))
+pdf_cache_lookups = registry.counter('liver_pdf_cache_lookups_total', 'PDF downloads by cache result.', ('result',))
+registry.gauge_function('liver_model_loaded', 'Whether the model is loaded and warmed up.',
+                        lambda: 1 if model_registry.is_ready() else 0)
+registry.register(model_latency)
+registry.gauge_function('liver_jobs_queued', 'Analyses waiting for a worker.', lambda: job_manager.stats()['queued'])
+registry.gauge_function('liver_jobs_running', 'Analyses currently running.', lambda: job_manager.stats()['running'])
+registry.counter_function('liver_jobs_rejected_total', 'Analyses rejected because the queue was full.',
+                          lambda: job_manager.rejected)
+registry.gauge_function('liver_inference_queue_depth', 'Requests waiting for a forward pass.',
+                        lambda: model_registry.active().engine.stats()['queue_depth'])
+registry.counter_function('liver_inference_batches_total', 'Forward passes run by the batching engine.',
+                          lambda: model_registry.active().engine.stats()['batches'])
+registry.counter_function('liver_inference_rows_total', 'Images run through the model.',
+                          lambda: model_registry.active().engine.stats()['rows'])
+registry.gauge_function('liver_result_store_pending', 'Analyses waiting to be written to the result store.',
+                        lambda: result_store.stats()['pending'] if result_store is not None else 0)
+registry.gauge_function('liver_artifact_memory_bytes', 'Bytes of artifacts held in memory.',
+                        lambda: artifact_store.stats()['memory_bytes'])
+
+PATIENT_FIELDS = ('name', 'national_id', 'nationality', 'age', 'mobile_number', 'gender',
+                  'chronic_diseases', 'liver_enzymes', 'bilirubin', 'albumin', 'weight', 'height')
+
+startup_timings["app_setup"] = time.perf_counter() - _started - startup_timings["imports"]
+
+def preprocess_image(image, target_size=(256, 256)):
+    # Accepts a path, raw bytes or an already decoded upload
+    image = load_image(image)
+    return prepare_model_input(image.gray, target_size)
 
 def calculate_tumor_volume(mask, pixel_spacing=(1, 1, 1)):
     tumor_pixels = np.sum(mask > 0.5)
     voxel_volume = pixel_spacing[0] * pixel_spacing[1] * pixel_spacing[2]
     volume = tumor_pixels * voxel_volume
-    return volume
+    return float(volume)
 
-def determine_liver_disease_type(image_path, mask):
+def determine_liver_disease_type(image, mask):
     mask = mask.squeeze()
     tumor_area = np.sum(mask > 0.5)
     total_area = mask.shape[0] * mask.shape[1]
     tumor_percentage = (tumor_area / total_area) * 100
     tumor_volume = calculate_tumor_volume(mask, (1, 1, 1))
+    disease_info = classify_tumor(tumor_percentage, tumor_volume)
     
+    # One large lesion and many small ones can have the same total area
+    labels, lesions = label_lesions_2d(mask, (1, 1, 1))
+    disease_info['lesions'] = lesions
+    disease_info.update(lesion_summary(lesions))
+    return disease_info
+
+def classify_tumor(tumor_percentage, tumor_volume):
     if tumor_percentage < 1:
         return {
             "type": "No Tumor Detected",
@@ -116,422 +236,481 @@ def determine_liver_disease_type(image_path, mask):
             "volume_category": "Large (>30 cm³)"
         }
 
-def generate_segmentation_visualization(image_path, mask):
-    original_img = Image.open(image_path)
-    original_img = original_img.resize((256, 256))
-    original_img = np.array(original_img)
-    
-    if len(original_img.shape) == 2:
-        original_img = np.stack((original_img,)*3, axis=-1)
-    
+def generate_segmentation_visualization(image, mask, lesions=None):
     mask = mask.squeeze()
     mask = (mask > 0.5).astype(np.uint8)
+    
+    # The mask is 256x256 in resize mode and full resolution in tiled mode
+    original_img = load_image(image).rgb((mask.shape[1], mask.shape[0]))
+    
     colored_mask = np.zeros_like(original_img)
     colored_mask[mask == 1] = [255, 0, 0]
     
     alpha = 0.5
     blended = cv2.addWeighted(original_img, 1 - alpha, colored_mask, alpha, 0)
     
-    fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(18, 6))
-    
-    ax1.imshow(original_img)
-    ax1.set_title('Original Image')
-    ax1.axis('off')
+    # Number each lesion so the overlay matches the lesion table in the report
+    thickness = max(1, mask.shape[0] // 256)
+    for lesion in lesions or []:
+        (x0, x1), (y0, y1) = lesion['bbox']['x'], lesion['bbox']['y']
+        cv2.rectangle(blended, (x0 - 1, y0 - 1), (x1 + 1, y1 + 1), (255, 255, 0), thickness)
+        cv2.putText(blended, str(lesion['id']), (x0, max(y0 - 3, 10)), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.35 * thickness, (255, 255, 0), thickness, cv2.LINE_AA)
     
-    ax2.imshow(mask, cmap='gray')
-    ax2.set_title('Segmentation Mask')
-    ax2.axis('off')
-    
-    ax3.imshow(blended)
-    ax3.set_title('Tumor Detection')
-    ax3.axis('off')
-    
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close(fig)
-    return buf
+    return io.BytesIO(render_triptych(original_img, mask, blended, backend=config.RENDER_BACKEND))
 
 def create_relationship_diagrams(age, gender, chronic_diseases, liver_enzymes, tumor_volume):
-    try:
-        clean_liver_enzymes = float(''.join(c for c in str(liver_enzymes) if c.isdigit() or c == '.'))
-    except ValueError:
-        clean_liver_enzymes = 0
-        
-    diagrams = []
-    
-    # Age risk diagram
-    fig1, ax1 = plt.subplots(figsize=(6, 4))
-    age_categories = ["<40", "40-60", ">60"]
-    age_risk_values = [0, 0, 0]
-    
-    if int(age) < 40:
-        age_risk_values[0] = 1
-    elif 40 <= int(age) <= 60:
-        age_risk_values[1] = 1
-    else:
-        age_risk_values[2] = 1
-    
-    ax1.pie(age_risk_values, labels=age_categories, autopct='%1.1f%%', colors=['lightblue', 'lightgreen', 'lightcoral'])
-    ax1.set_title("Age vs Liver Disease Risk")
-    diagrams.append(fig1)
-    
-    # Gender risk diagram
-    fig2, ax2 = plt.subplots(figsize=(6, 4))
-    gender_labels = ['Male', 'Female']
-    gender_risk_values = [1 if gender == "Male" else 0]
-    gender_risk_percent = [gender_risk_values[0] * 100, (1 - gender_risk_values[0]) * 100]
-    ax2.pie(gender_risk_percent, labels=gender_labels, autopct='%1.1f%%', colors=['lightblue', 'pink'])
-    ax2.set_title("Gender vs Liver Disease Risk")
-    diagrams.append(fig2)
-    
-    # Chronic diseases diagram
-    fig3, ax3 = plt.subplots(figsize=(6, 4))
-    chronic_categories = ["Patient Chronic Diseases"]
-    chronic_risk_values = [1 if chronic_diseases.lower() in ["hepatitis", "cirrhosis", "fatty liver"] else 0]
-    ax3.bar(chronic_categories, chronic_risk_values, color=['red'])
-    ax3.set_ylim(0, 1)
-    ax3.set_title("Chronic Diseases vs Liver Disease Risk")
-    ax3.set_ylabel("Chronic Liver Conditions (1=Yes, 0=No)")
-    diagrams.append(fig3)
-    
-    # Liver enzymes diagram
-    fig4, ax4 = plt.subplots(figsize=(6, 4))
-    enzyme_labels = ['High Risk (Elevated)', 'Normal']
-    enzyme_risk_values = [1 if clean_liver_enzymes > 40 else 0]
-    enzyme_risk_percent = [enzyme_risk_values[0] * 100, (1 - enzyme_risk_values[0]) * 100]
-    ax4.pie(enzyme_risk_percent, labels=enzyme_labels, autopct='%1.1f%%', colors=['red', 'green'])
-    ax4.set_title("Liver Enzymes vs Disease Risk")
-    diagrams.append(fig4)
-    
-    # Tumor Volume Diagram
-    fig5, ax5 = plt.subplots(figsize=(6, 4))
-    volume_categories = ["<1cm³", "1-5cm³", "5-10cm³", ">10cm³"]
-    volume_values = [0, 0, 0, 0]
-    
-    vol_cm3 = tumor_volume / 1000
-    if vol_cm3 < 1: volume_values[0] = 1
-    elif 1 <= vol_cm3 < 5: volume_values[1] = 1
-    elif 5 <= vol_cm3 < 10: volume_values[2] = 1
-    else: volume_values[3] = 1
-    
-    ax5.bar(volume_categories, volume_values, color=['green', 'yellow', 'orange', 'red'])
-    ax5.set_title("Tumor Volume Category")
-    ax5.set_ylabel("Risk Level")
-    diagrams.append(fig5)
-    
-    # Cause-Prevention Relationship Diagram
-    fig6, ax6 = plt.subplots(figsize=(8, 6))
-    causes = ['Hepatitis', 'Alcohol', 'NAFLD', 'Toxins', 'Genetics']
-    prevention = ['Vaccination', 'Moderation', 'Diet/Exercise', 'Avoidance', 'Screening']
-    relation_strength = [0.9, 0.8, 0.7, 0.6, 0.5]
-    
-    y_pos = np.arange(len(causes))
-    ax6.barh(y_pos, relation_strength, align='center', color='#4caf50')
-    ax6.set_yticks(y_pos)
-    ax6.set_yticklabels([f"{c}\n↓\n{p}" for c, p in zip(causes, prevention)])
-    ax6.invert_yaxis()
-    ax6.set_xlabel('Prevention Effectiveness')
-    ax6.set_title('Cause-Prevention Relationship')
-    diagrams.append(fig6)
-    
-    return diagrams
+    keys = chart_keys(age, gender, chronic_diseases, liver_enzymes, tumor_volume)
+    return [chart_atlas.get(chart, bucket) for chart, bucket in keys]
 
-def predict_and_generate_report(image_path, name, national_id, nationality, age, mobile_number, gender, 
+def predict_and_generate_report(image, name, national_id, nationality, age, mobile_number, gender, 
                               chronic_diseases, liver_enzymes, bilirubin, albumin, weight, height):
-    img_array = preprocess_image(image_path)
-    mask = model.predict(img_array)
+    # One model version for the whole analysis, even if another one is swapped in meanwhile
+    with model_registry.acquire() as model:
+        return analyze_with_model(model, image, name, national_id, nationality, age, mobile_number, gender,
+                                  chronic_diseases, liver_enzymes, bilirubin, albumin, weight, height)
+
+def analyze_with_model(model, image, name, national_id, nationality, age, mobile_number, gender,
+                       chronic_diseases, liver_enzymes, bilirubin, albumin, weight, height):
+    # Decoded once; preprocessing, analysis and rendering all share the same pixels
+    with stage_timer.stage('decode'):
+        image = load_image(image)
+    with stage_timer.stage('cache_lookup'):
+        cache_key = prediction_key(image.data, f"{model.version}/{prediction_settings}")
+        cached = prediction_cache.get(cache_key)
+    
+    if cached is not None:
+        prediction_cache_lookups.inc(result='hit')
+        mask = unpack_mask(cached['mask'], cached['mask_shape'])
+        disease_info = dict(cached['disease_info'])
+        disease_info.setdefault('skipped', False)
+        disease_info.setdefault('model_version', model.version)
+        if 'lesions' not in disease_info:
+            # Entries cached before lesion analysis existed
+            labels, lesions = label_lesions_2d(mask, (1, 1, 1))
+            disease_info['lesions'] = lesions
+            disease_info.update(lesion_summary(lesions))
+        visualization_buf = io.BytesIO(cached['overlay_png'])
+    else:
+        prediction_cache_lookups.inc(result='miss')
+        tiled = config.INFERENCE_MODE == "tiled"
+        with stage_timer.stage('preprocess'):
+            img_array = preprocess_image(image, target_size=None if tiled else (256, 256))
+        
+        skipped = False
+        if slice_filter is not None:
+            with stage_timer.stage('prefilter'):
+                skipped = not slice_filter.needs_model(img_array)[0]
+            prefilter_decisions.inc(result='skipped' if skipped else 'model')
+        
+        if skipped:
+            mask = np.zeros(img_array.shape, dtype=np.float32)
+        elif tiled:
+            with stage_timer.stage('inference'):
+                mask = tiled_predictor.predict(img_array[0, :, :, 0], model.predict)[np.newaxis, :, :, np.newaxis]
+        else:
+            with stage_timer.stage('inference'):
+                mask = model.predict(img_array)
+        
+        with stage_timer.stage('classify'):
+            disease_info = determine_liver_disease_type(image, mask)
+            disease_info['skipped'] = skipped
+            disease_info['model_version'] = model.version
+        with stage_timer.stage('visualization'):
+            visualization_buf = generate_segmentation_visualization(image, mask, disease_info['lesions'])
+        
+        with stage_timer.stage('cache_store'):
+            packed_mask, mask_shape = pack_mask(mask)
+            prediction_cache.put(cache_key, packed_mask, mask_shape, dict(disease_info), visualization_buf.getvalue())
+    
+    with stage_timer.stage('report'):
+        report = build_report(disease_info, name, national_id, nationality, age, mobile_number, gender,
+                              chronic_diseases, liver_enzymes, bilirubin, albumin, weight, height)
+    
+    diagrams = chart_keys(age, gender, chronic_diseases, liver_enzymes, disease_info['volume'])
+    
+    return report, visualization_buf, disease_info, diagrams, mask
+
+def run_analysis(image_data, patient):
+    # Runs on a job worker, so the stage breakdown travels back in the result
+    with metrics.profile() as timings:
+        try:
+            report, visualization_buf, disease_info, diagrams, mask = predict_and_generate_report(image_data,
+                                                                                                  **patient)
+        except Exception:
+            analysis_failures.inc()
+            raise
+        
+        with stage_timer.stage('store_artifacts'):
+            analysis_id = artifact_store.new_id()
+            artifact_store.put(analysis_id, 'visualization.png', visualization_buf.getvalue(), 'image/png')
+            artifact_store.put(analysis_id, 'report.json', json.dumps(report).encode('utf-8'), 'application/json')
+        
+        if result_store is not None:
+            with stage_timer.stage('store_result'):
+                result_store.save(analysis_id, patient, disease_info, mask,
+                                  model_version=disease_info['model_version'])
+    
+    return {
+        "analysis_id": analysis_id,
+        "patient": patient,
+        "report": report,
+        "disease_info": disease_info,
+        "model_version": disease_info['model_version'],
+        "diagrams": [list(key) for key in diagrams],
+        "timings": timings,
+    }
+
+def submit_analysis():
+    missing = [field for field in PATIENT_FIELDS if field not in request.form]
+    if missing:
+        return None, (f"Missing fields: {', '.join(missing)}", 400)
+    if 'image' not in request.files:
+        return None, ("No image uploaded", 400)
+    image = request.files['image']
+    if image.filename == '':
+        return None, ("No image selected", 400)
+    
+    patient = {field: request.form[field] for field in PATIENT_FIELDS}
+    
+    with stage_timer.stage('upload_read'):
+        image_data = image.read()
+    if audit_writer is not None:
+        audit_writer.save(image_data, image.filename)
     
-    disease_info = determine_liver_disease_type(image_path, mask)
-    visualization_buf = generate_segmentation_visualization(image_path, mask)
+    try:
+        with stage_timer.stage('job_submit'):
+            return job_manager.submit(run_analysis, image_data, patient), None
+    except JobQueueFull as e:
+        return None, (str(e), 503)
+
+def analysis_urls(result):
+    return {
+        "visualization_url": url_for('artifact', analysis_id=result['analysis_id'], name='visualization.png'),
+        "diagram_urls": [url_for('chart_image', chart=chart, bucket=bucket, v=chart_atlas.version)
+                         for chart, bucket in result['diagrams']],
+    }
+
+def profiling_requested():
+    return request.headers.get(config.PROFILE_HEADER, '0') not in ('', '0')
+
+def add_job_timings(job):
+    # The analysis ran on a worker thread; merge its stages into this request's profile
+    if g.get('profile') is not None and job.get('result'):
+        g.profile.update(job['result'].get('timings', {}))
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.profile = metrics.start_profile() if profiling_requested() else None
+    http_in_flight.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unmatched'
+    http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    http_latency.observe(elapsed, endpoint=endpoint)
+    if response.status_code >= 500:
+        http_errors.inc(endpoint=endpoint)
+    if g.get('profile') is not None:
+        response.headers['Server-Timing'] = metrics.server_timing(dict(g.profile, total=elapsed))
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if 'request_started' in g:
+        http_in_flight.dec()
+    metrics.stop_profile()
+
+@app.route('/', methods=['GET', 'POST'])
+def index():
+    if request.method == 'POST':
+        job_id, error = submit_analysis()
+        if error is not None:
+            return error
+        return redirect(url_for('job_result', job_id=job_id), code=303)
     
+    return render_template('index.html')
+
+@app.route('/results/<job_id>')
+def job_result(job_id):
+    with stage_timer.stage('job_wait'):
+        job = job_manager.wait(job_id, timeout=config.JOB_MAX_WAIT_SECONDS)
+    if job is None:
+        return "Analysis not found or expired", 404
+    add_job_timings(job)
+    if job['status'] == FAILED:
+        return f"An error occurred during the analysis: {job['error']}", 500
+    if job['status'] != DONE:
+        return ('<html><head><meta http-equiv="refresh" content="2"></head>'
+                '<body>Your scan is still being analyzed, this page will refresh automatically.</body></html>', 202)
+    
+    result = job['result']
+    urls = analysis_urls(result)
+    with stage_timer.stage('render_html'):
+        return render_template('result.html', 
+                             report=result['report'], 
+                             analysis_id=result['analysis_id'],
+                             visualization=urls['visualization_url'],
+                             diagrams=urls['diagram_urls'],
+                             disease_info=result['disease_info'])
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    job_id, error = submit_analysis()
+    if error is not None:
+        message, status = error
+        response = jsonify(error=message)
+        if status == 503:
+            response.headers['Retry-After'] = '1'
+        return response, status
+    
+    response = jsonify(job_id=job_id, status='pending', status_url=url_for('job_status', job_id=job_id))
+    return response, 202
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
     try:
-        bmi = float(weight) / ((float(height)/100) ** 2)
+        wait = min(float(request.args.get('wait', 0)), config.JOB_MAX_WAIT_SECONDS)
     except ValueError:
-        bmi = 0
+        return jsonify(error="wait must be a number of seconds"), 400
+    
+    job = job_manager.wait(job_id, timeout=wait) if wait > 0 else job_manager.get(job_id)
+    if job is None:
+        return jsonify(error="Job not found or expired"), 404
+    add_job_timings(job)
+    if job['status'] == DONE:
+        job['result'] = dict(job['result'], **analysis_urls(job['result']))
+        # Stage timings are only part of the response when profiling was asked for
+        if g.profile is None:
+            del job['result']['timings']
+    return jsonify(job)
+
+@app.route('/api/volume', methods=['POST'])
+def analyze_volume():
+    if 'volume' not in request.files:
+        return jsonify(error="No volume uploaded"), 400
+    volume = request.files['volume']
+    if not is_nifti_filename(volume.filename):
+        return jsonify(error="Expected a .nii or .nii.gz file"), 400
+    
+    os.makedirs(config.UPLOAD_DIR, exist_ok=True)
+    # nibabel needs a real file to memory-map and to detect gzip from the suffix
+    fd, volume_path = tempfile.mkstemp(suffix=nifti_suffix(volume.filename), dir=config.UPLOAD_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            volume.save(f)
+        with model_registry.acquire() as model:
+            stats = analyze_nifti_volume(volume_path, model.predict, batch_size=config.NIFTI_BATCH_SIZE,
+                                         slice_filter=slice_filter)
+            stats['model_version'] = model.version
+    except Exception as e:
+        return jsonify(error=f"Could not analyze volume: {str(e)}"), 400
+    finally:
+        os.remove(volume_path)
     
+    disease_info = classify_tumor(stats['tumor_percentage'], stats['volume'])
+    return jsonify(volume=stats, disease_info=disease_info)
+
+@app.route('/api/patients/<national_id>/history')
+def patient_history(national_id):
+    # A patient's diagnosis history is only for authorised callers
+    error = admin_error()
+    if error is not None:
+        return error
+    if result_store is None:
+        return jsonify(error="The result store is disabled"), 404
     try:
-        clean_liver_enzymes = float(''.join(c for c in str(liver_enzymes) if c.isdigit() or c == '.'))
+        limit = min(int(request.args.get('limit', 50)), 500)
+        before = float(request.args['before']) if 'before' in request.args else None
     except ValueError:
-        clean_liver_enzymes = 0
-    
-    report = (f"Name: {name}\nNational ID: {national_id}\nNationality: {nationality}\nAge: {age}\n"
-              f"Mobile Number: {mobile_number}\nGender: {gender}\nChronic Diseases: {chronic_diseases}\n"
-              f"Liver Enzymes (ALT): {clean_liver_enzymes} IU/L\nBilirubin: {bilirubin} mg/dL\n"
-              f"Albumin: {albumin} g/dL\nWeight: {weight} kg\nHeight: {height} cm\nBMI: {bmi:.1f}\n"
-              f"Tumor Volume: {disease_info['volume']:.2f} mm³ (~{disease_info['volume']/1000:.1f} cm³)\n"
-              f"Tumor Size Category: {disease_info['volume_category']}\n\n")
-    
-    report += f"Diagnosis: {disease_info['type']}\n\n"
-    report += f"Description: {disease_info['description']}\n\n"
-    
-    report += "Potential Causes:\n"
-    report += f"{disease_info['causes']}\n\n"
-    
-    report += "Recommended Treatment:\n"
-    report += f"{disease_info['treatment']}\n\n"
-    
-    report += "Prevention Strategies:\n"
-    report += f"{disease_info['prevention']}\n\n"
-    
-    if "No Tumor" in disease_info['type']:
-        report += (f"{name} shows no signs of liver tumors in the scan. No further treatment is required. "
-                   "However, if the patient has risk factors like hepatitis or alcohol use, "
-                   "regular monitoring is recommended.\n\n")
-    else:
-        report += (f"{name} has a liver condition that requires medical attention. "
-                   "Consultation with a hepatologist or oncologist is strongly recommended. "
-                   "Depending on the diagnosis, further tests like biopsy or additional imaging "
-                   "may be needed to confirm the diagnosis and plan treatment.\n\n")
-        
-        report += ("Additional Recommendations:\n"
-                   "- Avoid alcohol completely\n"
-                   "- Maintain healthy weight\n"
-                   "- Get vaccinated against hepatitis A and B if not already immune\n"
-                   "- Monitor liver function regularly\n"
-                   "- Follow a liver-friendly diet (low fat, moderate protein)\n"
-                   "- Stay hydrated\n"
-                   "- Avoid unnecessary medications that can stress the liver\n\n")
-    
-    report += "\nRelationships between Input Data and Diagnosis:\n"
-    
-    if int(age) > 60:
-        report += "- Age: Patients over 60 years old are at higher risk of liver cancer.\n"
-    else:
-        report += "- Age: Younger patients have a lower risk of liver cancer.\n"
-    
-    if gender == "Male":
-        report += "- Gender: Males have higher risk of liver cancer compared to females.\n"
-    else:
-        report += "- Gender: Females have lower risk of liver cancer compared to males.\n"
-    
-    if chronic_diseases.lower() in ["hepatitis", "cirrhosis", "fatty liver"]:
-        report += "- Chronic Diseases: Patients with chronic liver diseases are at higher risk of complications.\n"
-    else:
-        report += "- Chronic Diseases: No significant chronic liver diseases were reported.\n"
-    
-    if clean_liver_enzymes > 40:
-        report += "- Liver Enzymes: Elevated liver enzymes may indicate liver damage or inflammation.\n"
-    else:
-        report += "- Liver Enzymes: Normal liver enzyme levels.\n"
-    
-    vol_cm3 = disease_info['volume'] / 1000
-    if vol_cm3 < 1:
-        report += "- Tumor Volume: Very small tumor (<1 cm³), lower risk.\n"
-    elif 1 <= vol_cm3 < 5:
-        report += "- Tumor Volume: Small tumor (1-5 cm³), moderate risk.\n"
-    elif 5 <= vol_cm3 < 10:
-        report += "- Tumor Volume: Medium tumor (5-10 cm³), high risk.\n"
-    else:
-        report += "- Tumor Volume: Large tumor (>10 cm³), very high risk.\n"
-    
-    if bmi > 30:
-        report += "- BMI: Obesity is a risk factor for fatty liver disease and liver cancer.\n"
-    elif bmi > 25:
-        report += "- BMI: Overweight status may contribute to liver disease risk.\n"
-    else:
-        report += "- BMI: Healthy weight reduces liver disease risk.\n"
-    
-    diagrams = create_relationship_diagrams(age, gender, chronic_diseases, liver_enzymes, disease_info['volume'])
-    
-    return report, visualization_buf, disease_info, diagrams
+        return jsonify(error="limit and before must be numbers"), 400
+    return jsonify(national_id=national_id, analyses=result_store.history(national_id, limit=limit, before=before))
 
-@app.route('/', methods=['GET', 'POST'])
-def index():
-    if not os.path.exists('uploads'):
-        os.makedirs('uploads')
-    if not os.path.exists('static'):
-        os.makedirs('static')
-    
-    if request.method == 'POST':
-        name = request.form['name']
-        national_id = request.form['national_id']
-        nationality = request.form['nationality']
-        age = request.form['age']
-        mobile_number = request.form['mobile_number']
-        gender = request.form['gender']
-        chronic_diseases = request.form['chronic_diseases']
-        liver_enzymes = request.form['liver_enzymes']
-        bilirubin = request.form['bilirubin']
-        albumin = request.form['albumin']
-        weight = request.form['weight']
-        height = request.form['height']
-        
-        if 'image' not in request.files:
-            return "No image uploaded", 400
-        image = request.files['image']
-        if image.filename == '':
-            return "No image selected", 400
-        
-        image_path = os.path.join('uploads', image.filename)
-        image.save(image_path)
-        
-        report, visualization_buf, disease_info, diagrams = predict_and_generate_report(
-            image_path, name, national_id, nationality, age, mobile_number, gender,
-            chronic_diseases, liver_enzymes, bilirubin, albumin, weight, height)
-        
-        visualization_path = os.path.join('static', 'visualization.png')
-        with open(visualization_path, 'wb') as f:
-            f.write(visualization_buf.getbuffer())
-        
-        diagram_paths = []
-        for i, diagram in enumerate(diagrams):
-            buf = io.BytesIO()
-            diagram.savefig(buf, format='png')
-            buf.seek(0)
-            path = os.path.join('static', f'diagram_{i}.png')
-            with open(path, 'wb') as f:
-                f.write(buf.getbuffer())
-            diagram_paths.append(path)
-            plt.close(diagram)
-        
-        return render_template('result.html', 
-                             report=report, 
-                             visualization=visualization_path,
-                             diagrams=diagram_paths,
-                             disease_info=disease_info,
-                             age=age,
-                             gender=gender,
-                             chronic_diseases=chronic_diseases,
-                             liver_enzymes=liver_enzymes)
+@app.route('/api/patients/<national_id>/volume-trend')
+def patient_volume_trend(national_id):
+    error = admin_error()
+    if error is not None:
+        return error
+    if result_store is None:
+        return jsonify(error="The result store is disabled"), 404
+    return jsonify(result_store.volume_trend(national_id))
+
+@app.route('/charts/<chart>/<bucket>.png')
+def chart_image(chart, bucket):
+    try:
+        image = chart_atlas.get(chart, bucket)
+    except KeyError:
+        return "Unknown chart", 404
+    response = send_file(io.BytesIO(image), mimetype='image/png')
+    # Chart URLs carry the atlas version, so clients may cache them forever
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/artifacts/<analysis_id>/<name>')
+def artifact(analysis_id, name):
+    stored = artifact_store.get(analysis_id, name)
+    if stored is None:
+        return "Artifact not found or expired", 404
+    data, mimetype = stored
+    response = send_file(io.BytesIO(data), mimetype=mimetype, download_name=name)
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+@app.route('/healthz')
+def healthz():
+    return jsonify(status="alive", uptime_seconds=time.perf_counter() - _started)
+
+@app.route('/readyz')
+def readyz():
+    status = model_registry.status()
+    return jsonify(ready=model_registry.is_ready(), model=status), 200 if model_registry.is_ready() else 503
+
+@app.route('/startup')
+def startup():
+    manager = model_registry.active().manager
+    return jsonify(app=startup_timings, model=manager.status()['timings'], model_state=manager.state)
+
+@app.route('/inference/stats')
+def inference_stats():
+    return jsonify(model_registry.active().engine.stats())
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(prediction_cache.stats())
+
+@app.route('/api/jobs/stats')
+def job_stats():
+    return jsonify(job_manager.stats())
+
+@app.route('/artifacts/stats')
+def artifact_stats():
+    return jsonify(artifact_store.stats())
+
+@app.route('/prefilter/stats')
+def prefilter_stats():
+    if slice_filter is None:
+        return jsonify(enabled=False)
+    return jsonify(slice_filter.stats())
+
+@app.route('/api/results/stats')
+def result_store_stats():
+    if result_store is None:
+        return jsonify(enabled=False)
+    return jsonify(result_store.stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(registry.render(), content_type=metrics.CONTENT_TYPE)
+
+def admin_error():
+    # Admin routes stay off unless a token is configured
+    if config.ADMIN_TOKEN is None:
+        return jsonify(error="Admin routes are disabled"), 404
+    token = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode('utf-8'), config.ADMIN_TOKEN.encode('utf-8')):
+        return jsonify(error="Invalid admin token"), 403
+    return None
+
+def registry_call(fn, *args):
+    error = admin_error()
+    if error is not None:
+        return error
+    try:
+        fn(*args)
+    except KeyError as e:
+        return jsonify(error=str(e.args[0])), 404
+    except ValueError as e:
+        return jsonify(error=str(e)), 409
+    return jsonify(model_registry.stats())
+
+@app.route('/admin/models')
+def list_models():
+    error = admin_error()
+    if error is not None:
+        return error
+    return jsonify(model_registry.stats())
+
+@app.route('/admin/models', methods=['POST'])
+def load_model_version():
+    error = admin_error()
+    if error is not None:
+        return error
+    body = request.get_json(silent=True) or {}
+    backend = body.get('backend', config.INFERENCE_BACKEND)
+    if 'path' not in body:
+        return jsonify(error="path is required"), 400
+    if backend not in BACKENDS:
+        return jsonify(error=f"backend must be one of {', '.join(BACKENDS)}"), 400
+    if backend != 'server' and not os.path.isfile(body['path']):
+        return jsonify(error=f"No model file at {body['path']}"), 400
+    try:
+        fraction = float(body['canary_fraction']) if body.get('canary_fraction') is not None else None
+    except (TypeError, ValueError):
+        return jsonify(error="canary_fraction must be a number"), 400
+    if fraction is not None and not 0 <= fraction <= 1:
+        return jsonify(error="canary_fraction must be between 0 and 1"), 400
     
-    return render_template('index.html')
+    # Loading and warm-up run in the background; poll /admin/models for the state
+    try:
+        entry = model_registry.load(body['path'], version=body.get('version'), backend=backend,
+                                    num_threads=config.TFLITE_NUM_THREADS, activate=bool(body.get('activate')),
+                                    canary_fraction=fraction)
+    except ValueError as e:
+        return jsonify(error=str(e)), 409
+    return jsonify(entry.stats()), 202
+
+@app.route('/admin/models/<version>/activate', methods=['POST'])
+def activate_model_version(version):
+    return registry_call(model_registry.activate, version)
 
-@app.route('/download_pdf', methods=['POST'])
+@app.route('/admin/models/<version>', methods=['DELETE'])
+def unload_model_version(version):
+    return registry_call(model_registry.unload, version)
+
+@app.route('/admin/canary', methods=['PUT'])
+def set_canary():
+    error = admin_error()
+    if error is not None:
+        return error
+    body = request.get_json(silent=True) or {}
+    try:
+        fraction = float(body.get('fraction', 0.1))
+    except (TypeError, ValueError):
+        return jsonify(error="fraction must be a number"), 400
+    if not body.get('version'):
+        return jsonify(error="version is required"), 400
+    return registry_call(model_registry.set_canary, body.get('version'), fraction)
+
+@app.route('/admin/canary', methods=['DELETE'])
+def clear_canary():
+    return registry_call(model_registry.clear_canary)
+
+@app.route('/download_pdf', methods=['GET', 'POST'])
 def download_pdf():
     try:
-        report = request.form['report']
-        visualization_path = request.form['visualization']
-        age = request.form['age']
-        gender = request.form['gender']
-        chronic_diseases = request.form['chronic_diseases']
-        liver_enzymes = request.form['liver_enzymes']
-        
-        static_dir = os.path.join(os.path.dirname(__file__), 'static')
-        uploads_dir = os.path.join(os.path.dirname(__file__), 'uploads')
-        
-        os.makedirs(static_dir, exist_ok=True)
-        os.makedirs(uploads_dir, exist_ok=True)
-        
-        pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
-        
-        # Add title page
-        pdf.add_page()
-        pdf.set_font("Arial", style='B', size=16)
-        pdf.cell(200, 10, "Liver Tumor Detection Report", ln=True, align='C')
-        pdf.ln(20)
-        
-        # Add patient information table
-        pdf.set_font("Arial", style='B', size=12)
-        pdf.cell(0, 10, "Patient Information:", ln=True)
-        pdf.ln(5)
-        
-        pdf.set_font("Arial", style='B', size=10)
-        pdf.cell(60, 7, "Field", border=1)
-        pdf.cell(0, 7, "Value", border=1, ln=True)
-        
-        pdf.set_font("Arial", size=10)
-        lines = report.split("\n")
-        
-        patient_data = {
-            "Name": lines[0].split(": ")[1],
-            "National ID": lines[1].split(": ")[1],
-            "Nationality": lines[2].split(": ")[1],
-            "Age": lines[3].split(": ")[1],
-            "Mobile Number": lines[4].split(": ")[1],
-            "Gender": lines[5].split(": ")[1],
-            "Chronic Diseases": lines[6].split(": ")[1],
-            "Liver Enzymes (ALT)": lines[7].split(": ")[1],
-            "Bilirubin": lines[8].split(": ")[1],
-            "Albumin": lines[9].split(": ")[1],
-            "Weight": lines[10].split(": ")[1],
-            "Height": lines[11].split(": ")[1],
-            "BMI": lines[12].split(": ")[1]
-        }
-        
-        for field, value in patient_data.items():
-            pdf.cell(60, 7, field, border=1)
-            pdf.cell(0, 7, value, border=1, ln=True)
-        
-        pdf.ln(10)
-        
-        # Add diagnosis section
-        pdf.set_font("Arial", style='B', size=12)
-        pdf.cell(0, 10, "Diagnosis:", ln=True)
-        pdf.set_font("Arial", size=10)
-        
-        diagnosis_start = next((i for i, line in enumerate(lines) if "Diagnosis:" in line), len(lines))
-        risk_start = next((i for i, line in enumerate(lines) if "Relationships between Input Data and Diagnosis:" in line), len(lines))
-        
-        for line in lines[diagnosis_start:risk_start]:
-            if line.strip():
-                if "Diagnosis:" in line or "Description:" in line or "Recommended Treatment:" in line:
-                    pdf.set_font("Arial", style='B', size=11)
-                    pdf.cell(0, 7, line, ln=True)
-                    pdf.set_font("Arial", size=10)
-                else:
-                    pdf.multi_cell(0, 7, line)
-        
-        pdf.ln(5)
-        
-        # Add tumor volume info
-        pdf.set_font("Arial", style='B', size=12)
-        pdf.cell(0, 10, "Tumor Volume Analysis:", ln=True)
-        pdf.set_font("Arial", size=10)
-        
-        tumor_volume_line = next((line for line in lines if "Tumor Volume:" in line), "")
-        tumor_category_line = next((line for line in lines if "Tumor Size Category:" in line), "")
-        
-        pdf.cell(0, 7, tumor_volume_line, ln=True)
-        pdf.cell(0, 7, tumor_category_line, ln=True)
-        pdf.ln(5)
-        
-        # Add causes and prevention
-        pdf.set_font("Arial", style='B', size=12)
-        pdf.cell(0, 10, "Potential Causes:", ln=True)
-        pdf.set_font("Arial", size=10)
-        
-        causes = next((line.split("Potential Causes:")[1].strip() for line in lines if "Potential Causes:" in line), "")
-        pdf.multi_cell(0, 7, causes)
-        pdf.ln(5)
-        
-        pdf.set_font("Arial", style='B', size=12)
-        pdf.cell(0, 10, "Prevention Strategies:", ln=True)
-        pdf.set_font("Arial", size=10)
-        
-        prevention = next((line.split("Prevention Strategies:")[1].strip() for line in lines if "Prevention Strategies:" in line), "")
-        pdf.multi_cell(0, 7, prevention)
-        pdf.ln(5)
-        
-        # Add risk factors
-        if risk_start < len(lines):
-            pdf.set_font("Arial", style='B', size=12)
-            pdf.cell(0, 10, "Risk Factors Analysis:", ln=True)
-            pdf.set_font("Arial", size=10)
+        analysis_id = request.values['analysis_id']
+        
+        # Finished PDFs are cached with the analysis, so repeat downloads skip generation
+        with stage_timer.stage('pdf_lookup'):
+            cached = artifact_store.get(analysis_id, 'liver_report.pdf')
+        if cached is not None:
+            pdf_cache_lookups.inc(result='hit')
+            pdf_bytes = cached[0]
+        else:
+            pdf_cache_lookups.inc(result='miss')
+            report = artifact_store.get(analysis_id, 'report.json')
+            visualization = artifact_store.get(analysis_id, 'visualization.png')
+            if report is None or visualization is None:
+                return "This analysis has expired. Please submit the scan again.", 404
             
-            for line in lines[risk_start:]:
-                if line.strip():
-                    if line.startswith("-"):
-                        pdf.cell(10)
-                        pdf.cell(0, 7, line[2:], ln=True)
-                    else:
-                        pdf.cell(0, 7, line, ln=True)
-            pdf.ln(5)
-        
-        # Add visualization page
-        pdf.add_page()
-        pdf.set_font("Arial", style='B', size=12)
-        pdf.cell(0, 10, "Liver Scan Analysis:", ln=True)
-        pdf.image(visualization_path, x=10, y=None, w=180)
-        
-        pdf_path = os.path.join(static_dir, 'liver_report.pdf')
-        pdf.output(pdf_path)
-        
-        if not os.path.exists(pdf_path):
-            raise FileNotFoundError(f"Failed to create PDF file at {pdf_path}")
+            with stage_timer.stage('pdf_render'):
+                pdf_bytes = render_report_pdf(json.loads(report[0]), visualization[0])
+            artifact_store.put(analysis_id, 'liver_report.pdf', pdf_bytes, 'application/pdf')
         
-        return send_file(pdf_path, as_attachment=True)
+        return send_file(io.BytesIO(pdf_bytes), mimetype='application/pdf',
+                         as_attachment=True, download_name='liver_report.pdf')
     
     except Exception as e:
         print(f"Error generating PDF: {str(e)}")
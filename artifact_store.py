@@ -0,0 +1,145 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class ArtifactStore:
+    """Per-analysis artifacts (overlay PNGs, PDFs, ...) held in memory.
+
+    Every artifact expires ``ttl_seconds`` after it was stored. When the
+    in-memory total exceeds ``max_bytes`` the least recently used artifacts
+    are spilled to ``spill_dir``, or dropped if no spill directory is set.
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024, ttl_seconds=3600, spill_dir=None, sweep_interval=30):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        self.sweep_interval = sweep_interval
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+        self._memory = OrderedDict()
+        self._spilled = {}
+        self._bytes = 0
+        self._next_sweep = time.monotonic() + sweep_interval
+        self._lock = threading.Lock()
+
+        self.puts = 0
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self.spills = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    def put(self, artifact_id, name, data, mimetype):
+        data = bytes(data)
+        key = (artifact_id, name)
+        now = time.monotonic()
+        with self._lock:
+            self._discard(key)
+            self._memory[key] = {"data": data, "mimetype": mimetype, "expires": now + self.ttl_seconds}
+            self._bytes += len(data)
+            self.puts += 1
+            to_spill = self._shrink()
+        self._spill(to_spill)
+        self._maybe_sweep(now)
+
+    def get(self, artifact_id, name):
+        key = (artifact_id, name)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry["expires"] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry["data"], entry["mimetype"]
+            spilled = self._spilled.get(key)
+
+        data = None
+        if spilled is not None and spilled["expires"] > now:
+            try:
+                with open(spilled["path"], "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.spill_hits += 1
+            return data, spilled["mimetype"]
+
+    def sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._memory.items() if entry["expires"] <= now]
+            expired += [key for key, entry in self._spilled.items() if entry["expires"] <= now]
+            for key in expired:
+                self._discard(key)
+            self.expirations += len(expired)
+            self._next_sweep = now + self.sweep_interval
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_artifacts": len(self._memory),
+                "memory_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "spilled_artifacts": len(self._spilled),
+                "ttl_seconds": self.ttl_seconds,
+                "puts": self.puts,
+                "hits": self.hits,
+                "spill_hits": self.spill_hits,
+                "misses": self.misses,
+                "spills": self.spills,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _maybe_sweep(self, now):
+        if now >= self._next_sweep:
+            self.sweep()
+
+    def _discard(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry["data"])
+        spilled = self._spilled.pop(key, None)
+        if spilled is not None:
+            try:
+                os.remove(spilled["path"])
+            except OSError:
+                pass
+
+    def _shrink(self):
+        to_spill = []
+        while self._bytes > self.max_bytes and len(self._memory) > 1:
+            key, entry = self._memory.popitem(last=False)
+            self._bytes -= len(entry["data"])
+            if self.spill_dir:
+                to_spill.append((key, entry))
+            else:
+                self.evictions += 1
+        return to_spill
+
+    def _spill(self, to_spill):
+        for key, entry in to_spill:
+            # Hash the key so client-supplied IDs never end up in a file path
+            name = hashlib.sha256("/".join(key).encode("utf-8")).hexdigest()
+            path = os.path.join(self.spill_dir, name)
+            with open(path, "wb") as f:
+                f.write(entry["data"])
+            with self._lock:
+                self._spilled[key] = {"path": path, "mimetype": entry["mimetype"], "expires": entry["expires"]}
+                self.spills += 1
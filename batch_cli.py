@@ -0,0 +1,376 @@
+"""Score whole directories (or manifests) of scans offline.
+
+Every image gets one results row with its tumor pixel count, percentage,
+disease category and volume; NIfTI volumes get one row per volume. Rows
+are written as they are produced, so an interrupted run picks up where it
+stopped when started again with the same output::
+
+    python batch_cli.py archive/ results.csv
+    python batch_cli.py manifest.txt results.parquet --batch-size 16 --workers 8
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+COLUMNS = ("path", "kind", "status", "error", "height", "width", "slices", "tumor_pixels",
+           "tumor_percentage", "disease_type", "volume_category", "volume", "lesion_count",
+           "largest_lesion_diameter", "skipped_slices", "model_version")
+
+
+def is_scan_filename(filename):
+    from nifti import is_nifti_filename
+
+    return filename.lower().endswith(IMAGE_EXTENSIONS) or is_nifti_filename(filename)
+
+
+def iter_scan_paths(source, recursive=True):
+    """Yield scan paths from a directory, or from a manifest file with one path per line.
+
+    A ``.csv`` manifest is read through its ``path`` column (or its first
+    column if there is none). Relative manifest entries are resolved against
+    the manifest's directory.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            if not recursive:
+                dirs.clear()
+            for filename in sorted(files):
+                if is_scan_filename(filename):
+                    yield os.path.join(root, filename)
+        return
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="") as f:
+        if source.lower().endswith(".csv"):
+            reader = csv.reader(f)
+            header = next(reader, [])
+            column = header.index("path") if "path" in header else 0
+            if "path" not in header and header:
+                # No header row: the first line is already a path
+                yield os.path.join(base, header[column])
+            entries = (row[column] for row in reader if row)
+        else:
+            entries = (line.strip() for line in f)
+        for entry in entries:
+            if entry and not entry.startswith("#"):
+                yield os.path.join(base, entry)
+
+
+def decode_scan(path):
+    """Decode and preprocess one image; runs in the decode pool."""
+    from app import preprocess_image
+    from uploads import load_image
+
+    try:
+        image = load_image(path)
+        return path, image.shape, preprocess_image(image), None
+    except (OSError, ValueError) as e:
+        return path, None, None, str(e)
+
+
+class CsvResultWriter:
+    """Appends rows to a CSV file, flushing after every batch.
+
+    The file doubles as the checkpoint: paths already in it are skipped on
+    the next run, and a row cut short by a crash is dropped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._done = set()
+        if os.path.exists(path):
+            self._truncate_partial_row()
+            with open(path, newline="") as f:
+                self._done = {row["path"] for row in csv.DictReader(f)}
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        if is_new:
+            self._writer.writeheader()
+
+    def _truncate_partial_row(self):
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def done_paths(self):
+        return self._done
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResultWriter:
+    """Writes rows as numbered Parquet part files in a directory.
+
+    Parts are written atomically every ``rows_per_part`` rows, so at most
+    one part's worth of work is redone after an interruption.
+    """
+
+    def __init__(self, directory, rows_per_part=1000):
+        import pyarrow.parquet as pq
+
+        self.directory = directory
+        self.rows_per_part = rows_per_part
+        self._rows = []
+        os.makedirs(directory, exist_ok=True)
+        parts = sorted(f for f in os.listdir(directory) if f.startswith("part-") and f.endswith(".parquet"))
+        self._next_part = len(parts)
+        self._done = set()
+        for part in parts:
+            self._done.update(pq.read_table(os.path.join(directory, part), columns=["path"]).column("path").to_pylist())
+
+    def done_paths(self):
+        return self._done
+
+    def write(self, rows):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.rows_per_part:
+            self._flush()
+
+    def close(self):
+        if self._rows:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(self._rows, schema=pa.schema([
+            ("path", pa.string()), ("kind", pa.string()), ("status", pa.string()), ("error", pa.string()),
+            ("height", pa.int64()), ("width", pa.int64()), ("slices", pa.int64()), ("tumor_pixels", pa.int64()),
+            ("tumor_percentage", pa.float64()), ("disease_type", pa.string()), ("volume_category", pa.string()),
+            ("volume", pa.float64()), ("lesion_count", pa.int64()), ("largest_lesion_diameter", pa.float64()),
+            ("skipped_slices", pa.int64()), ("model_version", pa.string()),
+        ]))
+        path = os.path.join(self.directory, f"part-{self._next_part:05d}.parquet")
+        pq.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self._next_part += 1
+        self._rows = []
+
+
+def open_writer(output, rows_per_part):
+    if output.lower().endswith(".parquet"):
+        return ParquetResultWriter(output, rows_per_part)
+    return CsvResultWriter(output)
+
+
+class Progress:
+    """Counts finished scans and prints throughput to stderr at most every ``interval`` seconds."""
+
+    def __init__(self, interval=10.0, stream=sys.stderr):
+        self.interval = interval
+        self.stream = stream
+        self.started = time.perf_counter()
+        self._last_report = self.started
+        self.scans = 0
+        self.slices = 0
+        self.errors = 0
+        self.skipped = 0
+
+    def add(self, slices=1, error=False):
+        self.scans += 1
+        self.slices += slices
+        self.errors += int(error)
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            print(self.line(), file=self.stream, flush=True)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "scans": self.scans,
+            "slices": self.slices,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "elapsed_seconds": elapsed,
+            "scans_per_second": self.scans / elapsed if elapsed else 0.0,
+            "slices_per_second": self.slices / elapsed if elapsed else 0.0,
+        }
+
+    def line(self):
+        s = self.summary()
+        return (f"{s['scans']} scans ({s['errors']} errors, {s['skipped']} already done) in "
+                f"{s['elapsed_seconds']:.0f}s: {s['scans_per_second']:.1f} scans/s, "
+                f"{s['slices_per_second']:.1f} slices/s")
+
+
+def image_row(path, shape, mask, skipped, model_version):
+    from app import determine_liver_disease_type
+
+    disease_info = determine_liver_disease_type(path, mask)
+    tumor_pixels = int(np.count_nonzero(mask > 0.5))
+    return {
+        "path": path, "kind": "image", "status": "ok", "error": "",
+        "height": shape[0], "width": shape[1], "slices": 1,
+        "tumor_pixels": tumor_pixels,
+        "tumor_percentage": tumor_pixels / mask.size * 100,
+        "disease_type": disease_info["type"],
+        "volume_category": disease_info["volume_category"],
+        "volume": disease_info["volume"],
+        "lesion_count": disease_info["lesion_count"],
+        "largest_lesion_diameter": disease_info["largest_lesion_diameter"],
+        "skipped_slices": int(skipped),
+        "model_version": model_version,
+    }
+
+
+def volume_row(path, predict_fn, batch_size, model_version, slice_filter=None):
+    from app import classify_tumor
+    from nifti import analyze_nifti_volume
+
+    stats = analyze_nifti_volume(path, predict_fn, batch_size=batch_size, slice_filter=slice_filter)
+    disease_info = classify_tumor(stats["tumor_percentage"], stats["volume"])
+    return {
+        "path": path, "kind": "volume", "status": "ok", "error": "",
+        "height": stats["shape"][0], "width": stats["shape"][1], "slices": stats["slices_analyzed"],
+        "tumor_pixels": stats["tumor_voxels"],
+        "tumor_percentage": stats["tumor_percentage"],
+        "disease_type": disease_info["type"],
+        "volume_category": disease_info["volume_category"],
+        "volume": stats["volume"],
+        "lesion_count": stats["lesion_count"],
+        "largest_lesion_diameter": stats["largest_lesion_diameter"],
+        "skipped_slices": stats["slices_skipped"],
+        "model_version": model_version,
+    }
+
+
+def error_row(path, kind, error, model_version):
+    return dict({column: None for column in COLUMNS}, path=path, kind=kind, status="error",
+                error=error, model_version=model_version)
+
+
+def run_batch(paths, writer, predict_fn, decode_pool, batch_size=8, prefetch=32,
+              progress=None, model_version="", slice_filter=None):
+    from nifti import is_nifti_filename
+
+    progress = progress or Progress()
+    done = writer.done_paths()
+    pending = deque()
+    batch = np.empty((batch_size, 256, 256, 1), dtype=np.float32)
+    batch_items = []
+
+    def flush_batch():
+        if slice_filter is not None:
+            masks, skipped = slice_filter.predict(batch[:len(batch_items)], predict_fn)
+        else:
+            masks, skipped = predict_fn(batch[:len(batch_items)]), np.zeros(len(batch_items), dtype=bool)
+        rows = [image_row(path, shape, masks[i:i + 1], skipped[i], model_version)
+                for i, (path, shape) in enumerate(batch_items)]
+        writer.write(rows)
+        for _ in rows:
+            progress.add()
+        batch_items.clear()
+
+    def take_decoded():
+        path, shape, img_array, error = pending.popleft().result()
+        if error is not None:
+            writer.write([error_row(path, "image", error, model_version)])
+            progress.add(slices=0, error=True)
+            return
+        batch[len(batch_items)] = img_array[0]
+        batch_items.append((path, shape))
+        if len(batch_items) == batch_size:
+            flush_batch()
+
+    for path in paths:
+        if path in done:
+            progress.skipped += 1
+            continue
+        if is_nifti_filename(path):
+            # Volumes are sliced and batched by analyze_nifti_volume itself
+            try:
+                row = volume_row(path, predict_fn, batch_size, model_version, slice_filter)
+            except Exception as e:
+                row = error_row(path, "volume", str(e), model_version)
+            writer.write([row])
+            progress.add(slices=row["slices"] or 0, error=row["status"] == "error")
+            continue
+        pending.append(decode_pool.submit(decode_scan, path))
+        while len(pending) >= prefetch:
+            take_decoded()
+
+    while pending:
+        take_decoded()
+    if batch_items:
+        flush_batch()
+    return progress.summary()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="Directory of scans, or a manifest (.txt/.csv) listing them")
+    parser.add_argument("output", help="Results .csv file or .parquet directory; reused as the checkpoint")
+    parser.add_argument("--model", help="Model file (defaults to MODEL_PATH)")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Decode workers")
+    parser.add_argument("--processes", action="store_true", help="Decode in processes instead of threads")
+    parser.add_argument("--no-recursive", action="store_true", help="Only read the top level of the directory")
+    parser.add_argument("--prefilter", help="Trained pre-filter (.npz) to also skip slices without liver")
+    parser.add_argument("--no-prefilter", action="store_true", help="Run the model on every slice, even blank ones")
+    parser.add_argument("--rows-per-part", type=int, default=1000, help="Rows per Parquet part file")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args(argv)
+
+    # The app's model only loads when the batch first needs it, and its
+    # warm-up matches the batch size used here
+    if args.model:
+        os.environ["MODEL_PATH"] = args.model
+    os.environ.setdefault("MODEL_LOAD_MODE", "lazy")
+    os.environ.setdefault("MODEL_WARMUP_BATCH_SIZES", str(args.batch_size))
+    # Batch rows are not tied to patients, so the app's result store stays off
+    os.environ.setdefault("RESULT_DB_PATH", "")
+    if args.no_prefilter:
+        os.environ["PREFILTER"] = "0"
+    elif args.prefilter:
+        os.environ["PREFILTER_PATH"] = args.prefilter
+    import app
+
+    writer = open_writer(args.output, args.rows_per_part)
+    if args.processes:
+        # Spawned rather than forked so workers never inherit TensorFlow state
+        decode_pool = ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn"))
+    else:
+        decode_pool = ThreadPoolExecutor(args.workers, thread_name_prefix="batch-decode")
+
+    # Batches are already full, so they go straight to the model rather than the batching engine
+    model = app.model_registry.active().manager
+    progress = Progress(args.progress_interval)
+    try:
+        summary = run_batch(iter_scan_paths(args.source, recursive=not args.no_recursive), writer,
+                            model.predict, decode_pool, batch_size=args.batch_size,
+                            prefetch=max(args.workers, args.batch_size) * 2, progress=progress,
+                            model_version=model.version, slice_filter=app.slice_filter)
+    except KeyboardInterrupt:
+        print(f"Interrupted; rerun the same command to resume. {progress.line()}", file=sys.stderr)
+        summary = progress.summary()
+    finally:
+        writer.close()
+        decode_pool.shutdown(cancel_futures=True)
+
+    print(progress.line(), file=sys.stderr)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class _PendingRequest:
+    __slots__ = ("batch", "enqueued_at", "event", "result", "error")
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.enqueued_at = time.monotonic()
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchingInferenceEngine:
+    """Groups concurrent predict calls into a single forward pass.
+
+    Callers submit preprocessed tensors of shape (n, H, W, C). A background
+    thread waits until ``max_batch_size`` rows are queued or the oldest
+    request has waited ``max_wait_ms``, runs ``predict_fn`` once on the
+    concatenated batch and hands every caller back its own slice.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=5):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = deque()
+        self._queued_rows = 0
+        self._cond = threading.Condition()
+        self._worker = None
+        self._closed = False
+
+        self._batches = 0
+        self._requests = 0
+        self._rows = 0
+        self._errors = 0
+        self._max_batch_seen = 0
+        self._batch_size_counts = {}
+        self._total_wait = 0.0
+        self._total_predict = 0.0
+
+    def predict(self, batch, timeout=None):
+        pending = _PendingRequest(batch)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Inference engine is closed")
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="inference-engine", daemon=True)
+                self._worker.start()
+            self._queue.append(pending)
+            self._queued_rows += len(batch)
+            self._cond.notify()
+
+        if not pending.event.wait(timeout):
+            raise TimeoutError("Timed out waiting for inference")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._worker is not None:
+            self._worker.join()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": len(self._queue),
+                "queued_rows": self._queued_rows,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self._batches,
+                "requests": self._requests,
+                "rows": self._rows,
+                "errors": self._errors,
+                "avg_batch_size": self._rows / self._batches if self._batches else 0.0,
+                "max_batch_size_seen": self._max_batch_seen,
+                "batch_size_counts": dict(sorted(self._batch_size_counts.items())),
+                "avg_queue_wait_ms": self._total_wait / self._requests * 1000.0 if self._requests else 0.0,
+                "avg_predict_ms": self._total_predict / self._batches * 1000.0 if self._batches else 0.0,
+            }
+
+    def _collect(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+
+            deadline = self._queue[0].enqueued_at + self.max_wait
+            while self._queued_rows < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            # Always take at least one request, even if it alone exceeds the limit
+            taken = [self._queue.popleft()]
+            rows = len(taken[0].batch)
+            while self._queue and rows + len(self._queue[0].batch) <= self.max_batch_size:
+                pending = self._queue.popleft()
+                rows += len(pending.batch)
+                taken.append(pending)
+            self._queued_rows -= rows
+            return taken
+
+    def _run(self):
+        while True:
+            taken = self._collect()
+            if taken is None:
+                return
+
+            started = time.monotonic()
+            try:
+                if len(taken) == 1:
+                    batch = taken[0].batch
+                else:
+                    batch = np.concatenate([pending.batch for pending in taken], axis=0)
+                output = np.asarray(self.predict_fn(batch))
+            except Exception as e:
+                for pending in taken:
+                    pending.error = e
+                    pending.event.set()
+                with self._cond:
+                    self._errors += 1
+                continue
+            finished = time.monotonic()
+
+            offset = 0
+            for pending in taken:
+                n = len(pending.batch)
+                pending.result = output[offset:offset + n]
+                offset += n
+                pending.event.set()
+
+            with self._cond:
+                self._batches += 1
+                self._requests += len(taken)
+                self._rows += offset
+                self._max_batch_seen = max(self._max_batch_seen, offset)
+                self._batch_size_counts[offset] = self._batch_size_counts.get(offset, 0) + 1
+                self._total_wait += sum(started - pending.enqueued_at for pending in taken)
+                self._total_predict += finished - started
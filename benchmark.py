@@ -0,0 +1,277 @@
+"""Per-stage and end-to-end benchmarks for the liver tumor app.
+
+Runs fully offline on CPU: the trained model is replaced by a randomly
+initialised UNet with the same architecture (see unet.py), and scans are
+synthetic images. Results are written as JSON so runs can be compared::
+
+    python benchmark.py --output bench.json
+    python benchmark.py --concurrency 1 4 16 --requests 64 --base-filters 16
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+
+PATIENT = {
+    "name": "Benchmark Patient", "national_id": "0000000000", "nationality": "Synthetic",
+    "age": "55", "mobile_number": "0000000000", "gender": "Male", "chronic_diseases": "hepatitis",
+    "liver_enzymes": "52", "bilirubin": "1.1", "albumin": "4.0", "weight": "82", "height": "176",
+}
+
+
+def synthetic_scan(seed, size=256):
+    """PNG bytes of a CT-like slice: a bright body ellipse with a few dark and bright blobs."""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    img = np.zeros((size, size), dtype=np.float32)
+    cv2.ellipse(img, (size // 2, size // 2), (int(size * 0.42), int(size * 0.33)), 0, 0, 360, 0.45, -1)
+    for _ in range(rng.integers(2, 6)):
+        center = tuple(int(c) for c in rng.integers(size // 4, 3 * size // 4, size=2))
+        cv2.circle(img, center, int(rng.integers(size // 40, size // 10)), float(rng.uniform(0.1, 0.9)), -1)
+    img += rng.normal(0, 0.05, img.shape).astype(np.float32)
+    img = np.clip(cv2.GaussianBlur(img, (5, 5), 0) * 255, 0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode(".png", img)
+    return encoded.tobytes()
+
+
+def summarize(seconds):
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    return {
+        "n": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "min_ms": float(ms.min()),
+        "max_ms": float(ms.max()),
+    }
+
+
+def time_stage(fn, iterations, warmup=1):
+    for i in range(warmup):
+        fn(i)
+    timings = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        fn(warmup + i)
+        timings.append(time.perf_counter() - started)
+    return summarize(timings)
+
+
+def prepare_environment(args, workdir):
+    """Save a stand-in model and point the app's configuration at it before importing app."""
+    from unet import build_unet
+
+    model_path = os.path.join(workdir, "standin_unet.keras")
+    build_unet(base_filters=args.base_filters).save(model_path)
+
+    os.environ["MODEL_PATH"] = model_path
+    os.environ["MODEL_LOAD_MODE"] = "eager"
+    os.environ.setdefault("RENDER_BACKEND", args.render_backend)
+    os.environ.setdefault("JOB_QUEUE_SIZE", str(max(args.concurrency) * 2))
+    os.environ.setdefault("RESULT_DB_PATH", os.path.join(workdir, "results.db"))
+    return model_path
+
+
+def import_app():
+    import app
+
+    # The HTML templates sit next to app.py rather than in templates/
+    if not os.path.isdir(os.path.join(app.app.root_path, "templates")):
+        app.app.template_folder = app.app.root_path
+    return app
+
+
+def bench_stages(app, args):
+    from reports import build_report, render_report_pdf
+
+    scans = [synthetic_scan(seed, args.image_size) for seed in range(args.iterations + 1)]
+    images = [app.load_image(scan) for scan in scans]
+    model = app.model_registry.active().manager.get()
+    batch = app.preprocess_image(images[0])
+    mask = model.predict_on_batch(batch)
+    disease_info = app.determine_liver_disease_type(images[0], mask)
+
+    stages = {
+        "preprocess_image": time_stage(lambda i: app.preprocess_image(scans[i]), args.iterations),
+        "model_predict": time_stage(lambda i: model.predict(batch, verbose=0), args.iterations),
+        "model_predict_on_batch": time_stage(lambda i: model.predict_on_batch(batch), args.iterations),
+        "inference_engine": time_stage(lambda i: app.model_registry.predict(batch), args.iterations),
+        "determine_liver_disease_type": time_stage(
+            lambda i: app.determine_liver_disease_type(images[i], mask), args.iterations),
+        "generate_segmentation_visualization": time_stage(
+            lambda i: app.generate_segmentation_visualization(images[i], mask), args.iterations),
+        "create_relationship_diagrams": time_stage(
+            lambda i: app.create_relationship_diagrams(str(20 + i * 7 % 60), PATIENT["gender"],
+                                                       PATIENT["chronic_diseases"], PATIENT["liver_enzymes"],
+                                                       float(i * 3000)), args.iterations),
+    }
+
+    for batch_size in args.batch_sizes:
+        big_batch = np.repeat(batch, batch_size, axis=0)
+        result = time_stage(lambda i: model.predict_on_batch(big_batch), args.iterations)
+        result["slices_per_second"] = batch_size * 1000 / result["mean_ms"]
+        stages[f"model_predict_on_batch_{batch_size}"] = result
+
+    report = build_report(disease_info, **PATIENT)
+    overlay = app.generate_segmentation_visualization(images[0], mask).getvalue()
+    stages["render_report_pdf"] = time_stage(lambda i: render_report_pdf(report, overlay), args.iterations)
+
+    # Flask routes through the test client (no network): the form POST
+    # follows the redirect to the result page, so it covers the whole job
+    client = app.app.test_client()
+    analysis_ids = []
+
+    def post_index(i):
+        data = dict(PATIENT, image=(io.BytesIO(synthetic_scan(10_000 + i, args.image_size)), "scan.png"))
+        response = client.post("/", data=data, content_type="multipart/form-data", follow_redirects=True)
+        if response.status_code != 200:
+            raise RuntimeError(f"index POST returned {response.status_code}")
+        analysis_ids.append(response.get_data(as_text=True).split('name="analysis_id" value="')[1].split('"')[0])
+
+    stages["index_post"] = time_stage(post_index, args.iterations)
+
+    def download(i):
+        response = client.post("/download_pdf", data={"analysis_id": analysis_ids[i % len(analysis_ids)]})
+        if response.status_code != 200:
+            raise RuntimeError(f"download_pdf returned {response.status_code}")
+
+    # First download of each analysis builds the PDF, later ones hit the cache
+    stages["download_pdf"] = time_stage(download, len(analysis_ids) - 1)
+    stages["download_pdf_cached"] = time_stage(download, len(analysis_ids) - 1, warmup=0)
+    return stages
+
+
+def _multipart(fields, file_field, filename, file_bytes):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                 f'Content-Type: image/png\r\n\r\n'.encode() + file_bytes + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def bench_load(app, args):
+    """Concurrent HTTP clients against a threaded server running the app."""
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            bodies = [_multipart(PATIENT, "image", "scan.png", synthetic_scan(100_000 + concurrency * 1000 + i,
+                                                                             args.image_size))
+                      for i in range(args.requests)]
+            latencies, errors = [], []
+            lock = threading.Lock()
+            next_request = iter(range(args.requests))
+
+            def client():
+                while True:
+                    with lock:
+                        i = next(next_request, None)
+                    if i is None:
+                        return
+                    body, content_type = bodies[i]
+                    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type})
+                    started = time.perf_counter()
+                    try:
+                        with urllib.request.urlopen(request, timeout=120) as response:
+                            response.read()
+                        with lock:
+                            latencies.append(time.perf_counter() - started)
+                    except (urllib.error.URLError, OSError) as e:
+                        with lock:
+                            errors.append(str(e))
+
+            started = time.perf_counter()
+            threads = [threading.Thread(target=client) for _ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            result = {"concurrency": concurrency, "requests": args.requests, "errors": len(errors),
+                      "elapsed_s": elapsed, "requests_per_second": len(latencies) / elapsed}
+            if latencies:
+                result.update(summarize(latencies))
+            results.append(result)
+            print(f"concurrency={concurrency}: {result['requests_per_second']:.1f} req/s, "
+                  f"p50={result.get('p50_ms', 0):.0f}ms p95={result.get('p95_ms', 0):.0f}ms "
+                  f"p99={result.get('p99_ms', 0):.0f}ms errors={len(errors)}", file=sys.stderr)
+    finally:
+        server.shutdown()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=10, help="Timed iterations per stage")
+    parser.add_argument("--image-size", type=int, default=256, help="Side of the synthetic scans in pixels")
+    parser.add_argument("--base-filters", type=int, default=32,
+                        help="Width of the stand-in UNet (32 matches the trained model)")
+    parser.add_argument("--batch-sizes", type=int, nargs="*", default=[1, 4, 8])
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 4, 8])
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level")
+    parser.add_argument("--render-backend", default="matplotlib", choices=["matplotlib", "opencv"])
+    parser.add_argument("--skip-load", action="store_true", help="Only run the per-stage benchmarks")
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        prepare_environment(args, workdir)
+        app = import_app()
+
+        import tensorflow as tf
+
+        results = {
+            "timestamp": time.time(),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "tensorflow": tf.__version__,
+                "numpy": np.__version__,
+            },
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "app_config": {
+                "render_backend": app.config.RENDER_BACKEND,
+                "inference_backend": app.config.INFERENCE_BACKEND,
+                "inference_mode": app.config.INFERENCE_MODE,
+                "inference_max_batch_size": app.config.INFERENCE_MAX_BATCH_SIZE,
+                "job_workers": app.config.JOB_WORKERS,
+            },
+            "startup": {"app": app.startup_timings, "model": app.model_registry.status()["timings"]},
+            "stages": bench_stages(app, args),
+        }
+        if not args.skip_load:
+            results["load"] = bench_load(app, args)
+        results["inference_engine"] = app.model_registry.active().engine.stats()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
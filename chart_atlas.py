@@ -0,0 +1,138 @@
+import hashlib
+import threading
+
+from rendering import render_chart
+
+# Every risk chart depends on a single discrete bucket of the patient data,
+# so the whole set of variants is small enough to render once and reuse
+BUCKETS = {
+    "age": ("under_40", "40_to_60", "over_60"),
+    "gender": ("male", "female"),
+    "chronic": ("yes", "no"),
+    "enzymes": ("elevated", "normal"),
+    "volume": ("under_1", "1_to_5", "5_to_10", "over_10"),
+    "cause_prevention": ("all",),
+}
+CHARTS = tuple(BUCKETS)
+
+
+def age_bucket(age):
+    if int(age) < 40:
+        return "under_40"
+    elif 40 <= int(age) <= 60:
+        return "40_to_60"
+    return "over_60"
+
+
+def gender_bucket(gender):
+    return "male" if gender == "Male" else "female"
+
+
+def chronic_bucket(chronic_diseases):
+    return "yes" if chronic_diseases.lower() in ["hepatitis", "cirrhosis", "fatty liver"] else "no"
+
+
+def enzymes_bucket(liver_enzymes):
+    try:
+        clean_liver_enzymes = float(''.join(c for c in str(liver_enzymes) if c.isdigit() or c == '.'))
+    except ValueError:
+        clean_liver_enzymes = 0
+    return "elevated" if clean_liver_enzymes > 40 else "normal"
+
+
+def volume_bucket(tumor_volume):
+    vol_cm3 = tumor_volume / 1000
+    if vol_cm3 < 1:
+        return "under_1"
+    elif 1 <= vol_cm3 < 5:
+        return "1_to_5"
+    elif 5 <= vol_cm3 < 10:
+        return "5_to_10"
+    return "over_10"
+
+
+def chart_keys(age, gender, chronic_diseases, liver_enzymes, tumor_volume):
+    return [
+        ("age", age_bucket(age)),
+        ("gender", gender_bucket(gender)),
+        ("chronic", chronic_bucket(chronic_diseases)),
+        ("enzymes", enzymes_bucket(liver_enzymes)),
+        ("volume", volume_bucket(tumor_volume)),
+        ("cause_prevention", "all"),
+    ]
+
+
+def _one_hot(buckets, bucket):
+    return [1 if b == bucket else 0 for b in buckets]
+
+
+def chart_spec(chart, bucket):
+    if bucket not in BUCKETS.get(chart, ()):
+        raise KeyError(f"Unknown chart variant: {chart}/{bucket}")
+
+    if chart == "age":
+        return {"kind": "pie", "figsize": (6, 4), "title": "Age vs Liver Disease Risk",
+                "labels": ["<40", "40-60", ">60"], "values": _one_hot(BUCKETS["age"], bucket),
+                "colors": ['lightblue', 'lightgreen', 'lightcoral']}
+    if chart == "gender":
+        male = 1 if bucket == "male" else 0
+        return {"kind": "pie", "figsize": (6, 4), "title": "Gender vs Liver Disease Risk",
+                "labels": ['Male', 'Female'], "values": [male * 100, (1 - male) * 100],
+                "colors": ['lightblue', 'pink']}
+    if chart == "chronic":
+        return {"kind": "bar", "figsize": (6, 4), "title": "Chronic Diseases vs Liver Disease Risk",
+                "labels": ["Patient Chronic Diseases"], "values": [1 if bucket == "yes" else 0],
+                "colors": ['red'], "ylim": (0, 1), "ylabel": "Chronic Liver Conditions (1=Yes, 0=No)"}
+    if chart == "enzymes":
+        elevated = 1 if bucket == "elevated" else 0
+        return {"kind": "pie", "figsize": (6, 4), "title": "Liver Enzymes vs Disease Risk",
+                "labels": ['High Risk (Elevated)', 'Normal'], "values": [elevated * 100, (1 - elevated) * 100],
+                "colors": ['red', 'green']}
+    if chart == "volume":
+        return {"kind": "bar", "figsize": (6, 4), "title": "Tumor Volume Category",
+                "labels": ["<1cm³", "1-5cm³", "5-10cm³", ">10cm³"], "values": _one_hot(BUCKETS["volume"], bucket),
+                "colors": ['green', 'yellow', 'orange', 'red'], "ylabel": "Risk Level"}
+
+    causes = ['Hepatitis', 'Alcohol', 'NAFLD', 'Toxins', 'Genetics']
+    prevention = ['Vaccination', 'Moderation', 'Diet/Exercise', 'Avoidance', 'Screening']
+    return {"kind": "barh", "figsize": (8, 6), "title": "Cause-Prevention Relationship",
+            "labels": [f"{c}\n↓\n{p}" for c, p in zip(causes, prevention)],
+            "values": [0.9, 0.8, 0.7, 0.6, 0.5], "colors": '#4caf50',
+            "xlabel": "Prevention Effectiveness", "invert": True}
+
+
+class ChartAtlas:
+    """Encoded PNGs of every chart variant, rendered at most once each.
+
+    ``version`` changes whenever the backend or any chart spec changes, so it
+    can be put in chart URLs that are served with long-lived cache headers.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._images = {}
+        self._lock = threading.Lock()
+
+        digest = hashlib.sha256(backend.encode("utf-8"))
+        for chart in CHARTS:
+            for bucket in BUCKETS[chart]:
+                digest.update(repr((chart, bucket, chart_spec(chart, bucket))).encode("utf-8"))
+        self.version = digest.hexdigest()[:12]
+
+    def get(self, chart, bucket):
+        image = self._images.get((chart, bucket))
+        if image is not None:
+            return image
+        spec = chart_spec(chart, bucket)
+        with self._lock:
+            image = self._images.get((chart, bucket))
+            if image is None:
+                image = render_chart(spec, backend=self.backend)
+                self._images[(chart, bucket)] = image
+        return image
+
+    def prerender(self):
+        for chart in CHARTS:
+            for bucket in BUCKETS[chart]:
+                self.get(chart, bucket)
+        return len(self._images)
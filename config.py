@@ -0,0 +1,72 @@
+import os
+
+# Model
+MODEL_PATH = os.environ.get("MODEL_PATH", "liver_tumor_segmentation_final.keras")
+# "keras", "tflite" (see tflite_backend.py for converting the model) or "server"
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "keras")
+TFLITE_MODEL_PATH = os.environ.get("TFLITE_MODEL_PATH", os.path.splitext(MODEL_PATH)[0] + ".tflite")
+TFLITE_NUM_THREADS = int(os.environ["TFLITE_NUM_THREADS"]) if os.environ.get("TFLITE_NUM_THREADS") else None
+# Socket of a running model_server.py, used by the "server" backend
+MODEL_SERVER_SOCKET = os.environ.get("MODEL_SERVER_SOCKET", "/tmp/liver-model.sock")
+# "background" starts loading at import, "lazy" on the first prediction, "eager" blocks the import
+MODEL_LOAD_MODE = os.environ.get("MODEL_LOAD_MODE", "background")
+
+# Micro-batching inference engine
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get("INFERENCE_MAX_BATCH_SIZE", "8"))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get("INFERENCE_MAX_WAIT_MS", "5"))
+MODEL_WARMUP_BATCH_SIZES = [int(n) for n in os.environ.get(
+    "MODEL_WARMUP_BATCH_SIZES", f"1,{INFERENCE_MAX_BATCH_SIZE}").split(",") if n.strip()]
+
+# NIfTI volume inference
+NIFTI_BATCH_SIZE = int(os.environ.get("NIFTI_BATCH_SIZE", str(INFERENCE_MAX_BATCH_SIZE)))
+
+# Prediction cache
+# Defaults to a hash of the model file when not set
+MODEL_VERSION = os.environ.get("MODEL_VERSION")
+PREDICTION_CACHE_MAX_BYTES = int(os.environ.get("PREDICTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PREDICTION_CACHE_DIR = os.environ.get("PREDICTION_CACHE_DIR") or None
+
+# Rendering: "matplotlib" or "opencv"
+RENDER_BACKEND = os.environ.get("RENDER_BACKEND", "matplotlib")
+
+# Render every risk chart variant at startup instead of on first use
+CHART_ATLAS_PRERENDER = os.environ.get("CHART_ATLAS_PRERENDER", "0") == "1"
+
+# Per-analysis artifact store
+ARTIFACT_MAX_BYTES = int(os.environ.get("ARTIFACT_MAX_BYTES", str(128 * 1024 * 1024)))
+ARTIFACT_TTL_SECONDS = int(os.environ.get("ARTIFACT_TTL_SECONDS", "3600"))
+ARTIFACT_SPILL_DIR = os.environ.get("ARTIFACT_SPILL_DIR") or None
+
+# Asynchronous analysis jobs
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "16"))
+JOB_RESULT_TTL_SECONDS = int(os.environ.get("JOB_RESULT_TTL_SECONDS", "3600"))
+JOB_MAX_WAIT_SECONDS = float(os.environ.get("JOB_MAX_WAIT_SECONDS", "30"))
+
+# "resize" squashes uploads to the model input size, "tiled" runs
+# overlapping 256x256 tiles over the full-resolution image
+INFERENCE_MODE = os.environ.get("INFERENCE_MODE", "resize")
+TILE_OVERLAP = float(os.environ.get("TILE_OVERLAP", "0.25"))
+TILE_BATCH_SIZE = int(os.environ.get("TILE_BATCH_SIZE", str(INFERENCE_MAX_BATCH_SIZE)))
+
+# Keep a copy of every upload on disk for auditing (written in the background)
+SAVE_UPLOADS = os.environ.get("SAVE_UPLOADS", "0") == "1"
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "uploads")
+
+# Requests carrying this header (any value other than "0") get a Server-Timing
+# response header with their stage breakdown
+PROFILE_HEADER = os.environ.get("PROFILE_HEADER", "X-Profile")
+
+# Patient result history (SQLite); set RESULT_DB_PATH to an empty string to disable.
+# It holds patient data, so it lives under data/ (git-ignored) rather than the repo root
+RESULT_DB_PATH = os.environ.get("RESULT_DB_PATH", os.path.join("data", "results.db")) or None
+RESULT_STORE_BATCH_SIZE = int(os.environ.get("RESULT_STORE_BATCH_SIZE", "64"))
+RESULT_STORE_FLUSH_SECONDS = float(os.environ.get("RESULT_STORE_FLUSH_SECONDS", "0.5"))
+
+# Skip the model on blank slices; PREFILTER_PATH adds a trained no-liver classifier (see prefilter.py)
+PREFILTER = os.environ.get("PREFILTER", "1") == "1"
+PREFILTER_PATH = os.environ.get("PREFILTER_PATH") or None
+
+# Admin routes (/admin/models and the patient history API) take this token in the
+# X-Admin-Token header; they are disabled when it is not set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
@@ -0,0 +1,310 @@
+"""Sharded slice caches and a streaming tf.data input pipeline for training.
+
+Volumes are decoded once into fixed-size shards of preprocessed slices
+(``.npy`` files that are memory-mapped at training time) together with
+per-slice statistics. Training then streams batches from the shards, so
+RAM stays bounded however many volumes are used::
+
+    python data_pipeline.py preprocess slice_cache /kaggle/input/liver-tumor-segmentation/volume_pt1 \
+        /kaggle/input/liver-tumor-segmentation/volume_pt2 --masks /kaggle/input/liver-tumor-segmentation/segmentations
+    python data_pipeline.py describe slice_cache
+"""
+import argparse
+import json
+import os
+import re
+
+import cv2
+import numpy as np
+
+from nifti import is_nifti_filename, iter_nifti_slices, load_nifti, preprocess_slice
+
+CACHE_VERSION = 2
+# Label values of the LiTS segmentations
+LIVER, TUMOR = 1, 2
+TARGETS = {"liver": LIVER, "tumor": TUMOR}
+MANIFEST = "manifest.json"
+STATS = "stats.npz"
+
+
+def _volume_number(filename):
+    match = re.search(r"(\d+)\.nii(\.gz)?$", filename.lower())
+    return int(match.group(1)) if match else None
+
+
+def find_volume_pairs(volume_paths, mask_dir):
+    """Pair every CT volume under ``volume_paths`` with its segmentation in ``mask_dir``.
+
+    Files are matched on their trailing number, as in the LiTS naming
+    (``volume-12.nii`` and ``segmentation-12.nii``). Volumes without a
+    segmentation are skipped.
+    """
+    masks = {}
+    for filename in os.listdir(mask_dir):
+        if is_nifti_filename(filename) and _volume_number(filename) is not None:
+            masks[_volume_number(filename)] = os.path.join(mask_dir, filename)
+
+    pairs = []
+    for volume_path in volume_paths:
+        for filename in sorted(os.listdir(volume_path), key=lambda f: (_volume_number(f) is None, _volume_number(f), f)):
+            if not is_nifti_filename(filename):
+                continue
+            mask = masks.get(_volume_number(filename))
+            if mask is None:
+                print(f"No segmentation for {filename}, skipping")
+                continue
+            pairs.append((os.path.join(volume_path, filename), mask))
+    return pairs
+
+
+def _to_uint8(slice_img, target_size):
+    # Same normalisation as the notebook (min-max to 0-255, resize), kept as
+    # 8 bits on disk; the pipeline scales it to [0, 1]
+    return np.clip(np.rint(preprocess_slice(slice_img, target_size) * 255), 0, 255).astype(np.uint8)
+
+
+def _labels_uint8(mask_img, target_size):
+    # Label values are kept (the notebook min-max normalised them per slice, so
+    # liver was 1.0 on some slices and 0.5 on others) and resized with nearest
+    # neighbour so edges never blend into fractional labels
+    labels = np.clip(np.rint(mask_img), 0, 255).astype(np.uint8)
+    return cv2.resize(labels, target_size, interpolation=cv2.INTER_NEAREST)
+
+
+class _ShardWriter:
+    def __init__(self, cache_dir, shard_size, target_size):
+        self.cache_dir = cache_dir
+        self.shard_size = shard_size
+        shape = (shard_size, target_size[1], target_size[0])
+        self._images = np.empty(shape, dtype=np.uint8)
+        self._masks = np.empty(shape, dtype=np.uint8)
+        self._count = 0
+        self.shards = []
+
+    @property
+    def position(self):
+        return len(self.shards), self._count
+
+    def add(self, image, mask):
+        self._images[self._count] = image
+        self._masks[self._count] = mask
+        self._count += 1
+        if self._count == self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if not self._count:
+            return
+        name = f"{len(self.shards):05d}"
+        np.save(os.path.join(self.cache_dir, f"images-{name}.npy"), self._images[:self._count])
+        np.save(os.path.join(self.cache_dir, f"masks-{name}.npy"), self._masks[:self._count])
+        self.shards.append({"images": f"images-{name}.npy", "masks": f"masks-{name}.npy", "slices": self._count})
+        self._count = 0
+
+
+def preprocess_volumes(pairs, cache_dir, target_size=(256, 256), shard_size=512):
+    """Convert (volume, segmentation) pairs into a sharded slice cache in ``cache_dir``.
+
+    Every slice is kept. Its statistics (raw CT max, mask coverage, ...) are
+    stored alongside so empty slices can be skipped at training time without
+    rebuilding the cache. Only one shard is held in memory at a time.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    writer = _ShardWriter(cache_dir, shard_size, target_size)
+    stats = {name: [] for name in ("shard", "offset", "volume", "z", "image_max", "image_mean",
+                                   "mask_max", "mask_fraction")}
+    volumes = []
+
+    for volume_index, (volume_path, mask_path) in enumerate(pairs):
+        try:
+            volume = load_nifti(volume_path)
+            mask = load_nifti(mask_path)
+        except Exception as e:
+            print(f"Error loading {volume_path}: {str(e)}")
+            continue
+        depth = min(volume.shape[2], mask.shape[2])
+        if volume.shape[2] != mask.shape[2]:
+            print(f"{volume_path} has {volume.shape[2]} slices but its mask has {mask.shape[2]}, using {depth}")
+
+        # Slices are paired by index, so CT slices and masks can't drift apart
+        for (z, slice_img), (_, mask_img) in zip(iter_nifti_slices(volume), iter_nifti_slices(mask)):
+            if z >= depth:
+                break
+            shard, offset = writer.position
+            stats["shard"].append(shard)
+            stats["offset"].append(offset)
+            stats["volume"].append(volume_index)
+            stats["z"].append(z)
+            stats["image_max"].append(float(slice_img.max()))
+            stats["mask_max"].append(float(mask_img.max()))
+            stats["mask_fraction"].append(float(np.count_nonzero(mask_img)) / mask_img.size)
+            image = _to_uint8(slice_img, target_size)
+            stats["image_mean"].append(float(image.mean()) / 255)
+            writer.add(image, _labels_uint8(mask_img, target_size))
+
+        volumes.append({"volume": volume_path, "mask": mask_path, "slices": depth})
+        print(f"Cached {depth} slices from {volume_path} ({len(stats['z'])} total)")
+
+    writer.flush()
+    np.savez(os.path.join(cache_dir, STATS), **{
+        name: np.asarray(values, dtype=np.int32 if name in ("shard", "offset", "volume", "z") else np.float32)
+        for name, values in stats.items()})
+    manifest = {
+        "version": CACHE_VERSION,
+        "target_size": list(target_size),
+        "shard_size": shard_size,
+        "slices": len(stats["z"]),
+        "volumes": volumes,
+        "shards": writer.shards,
+    }
+    # Written last: a cache without a manifest is incomplete
+    with open(os.path.join(cache_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class SliceCache:
+    """Read access to a cache written by ``preprocess_volumes``; shards are memory-mapped on first use."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != CACHE_VERSION:
+            raise ValueError(f"{cache_dir} was written by a different cache version, rebuild it")
+        with np.load(os.path.join(cache_dir, STATS)) as stats:
+            self.stats = {name: stats[name] for name in stats.files}
+        self._shards = {}
+
+    def __len__(self):
+        return self.manifest["slices"]
+
+    def select(self, volumes=None, skip_empty_images=True, skip_empty_masks=False):
+        """Indices of the slices to train on.
+
+        ``skip_empty_images`` drops all-zero CT slices, like the notebook's
+        loader; ``skip_empty_masks`` also drops slices without any labelled
+        liver or tumor.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if volumes is not None:
+            keep &= np.isin(self.stats["volume"], list(volumes))
+        if skip_empty_images:
+            keep &= self.stats["image_max"] != 0
+        if skip_empty_masks:
+            keep &= self.stats["mask_max"] > 0
+        return np.flatnonzero(keep)
+
+    def split_volumes(self, val_fraction=0.2, seed=42):
+        """Split by volume rather than by slice, so neighbouring slices never leak into validation."""
+        volumes = np.random.default_rng(seed).permutation(len(self.manifest["volumes"]))
+        n_val = max(1, int(round(len(volumes) * val_fraction))) if len(volumes) > 1 else 0
+        return sorted(volumes[n_val:].tolist()), sorted(volumes[:n_val].tolist())
+
+    def read(self, indices):
+        """Images and label masks (uint8, N x H x W) for the given slice indices."""
+        indices = np.asarray(indices)
+        height, width = self.manifest["target_size"][1], self.manifest["target_size"][0]
+        images = np.empty((len(indices), height, width), dtype=np.uint8)
+        masks = np.empty_like(images)
+        shards = self.stats["shard"][indices]
+        offsets = self.stats["offset"][indices]
+        for shard in np.unique(shards):
+            rows = np.flatnonzero(shards == shard)
+            shard_images, shard_masks = self._shard(int(shard))
+            images[rows] = shard_images[offsets[rows]]
+            masks[rows] = shard_masks[offsets[rows]]
+        return images, masks
+
+    def _shard(self, shard):
+        arrays = self._shards.get(shard)
+        if arrays is None:
+            entry = self.manifest["shards"][shard]
+            arrays = self._shards[shard] = (
+                np.load(os.path.join(self.cache_dir, entry["images"]), mmap_mode="r"),
+                np.load(os.path.join(self.cache_dir, entry["masks"]), mmap_mode="r"),
+            )
+        return arrays
+
+
+def make_dataset(cache, batch_size=8, volumes=None, shuffle=True, shuffle_buffer=None, skip_empty_images=True,
+                 skip_empty_masks=False, repeat=False, seed=42, drop_remainder=False, target="tumor"):
+    """A ``tf.data.Dataset`` of (image, mask) float32 batches shaped (B, H, W, 1) in [0, 1].
+
+    Masks are binary: ``target="tumor"`` marks tumor pixels, ``"liver"``
+    the whole liver including its tumors.
+
+    Only slice indices are shuffled (by default all of them, which costs a
+    few bytes per slice); pixels are read from the memory-mapped shards a
+    batch at a time in parallel map calls and prefetched.
+    """
+    import tensorflow as tf
+
+    if target not in TARGETS:
+        raise ValueError(f"target must be one of {', '.join(TARGETS)}")
+    min_label = TARGETS[target]
+    if not isinstance(cache, SliceCache):
+        cache = SliceCache(cache)
+    indices = cache.select(volumes, skip_empty_images=skip_empty_images, skip_empty_masks=skip_empty_masks)
+    width, height = cache.manifest["target_size"]
+
+    def load_batch(batch_indices):
+        # Reading in index order keeps memory-mapped access mostly sequential
+        order = np.argsort(batch_indices)
+        images, masks = cache.read(batch_indices[order])
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        return images[inverse], masks[inverse]
+
+    def to_tensors(batch_indices):
+        images, masks = tf.numpy_function(load_batch, [batch_indices], [tf.uint8, tf.uint8])
+        images = tf.reshape(tf.cast(images, tf.float32) / 255.0, [-1, height, width, 1])
+        masks = tf.reshape(tf.cast(masks >= min_label, tf.float32), [-1, height, width, 1])
+        return images, masks
+
+    dataset = tf.data.Dataset.from_tensor_slices(indices.astype(np.int64))
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer or max(len(indices), 1), seed=seed, reshuffle_each_iteration=True)
+    if repeat:
+        dataset = dataset.repeat()
+    dataset = dataset.batch(batch_size, drop_remainder=drop_remainder)
+    dataset = dataset.map(to_tensors, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def describe(cache):
+    stats = cache.stats
+    return {
+        "slices": len(cache),
+        "volumes": len(cache.manifest["volumes"]),
+        "shards": len(cache.manifest["shards"]),
+        "empty_image_slices": int(np.count_nonzero(stats["image_max"] == 0)),
+        "empty_mask_slices": int(np.count_nonzero(stats["mask_max"] == 0)),
+        "bytes": sum(os.path.getsize(os.path.join(cache.cache_dir, entry[kind]))
+                     for entry in cache.manifest["shards"] for kind in ("images", "masks")),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    preprocess = commands.add_parser("preprocess", help="Build a slice cache from NIfTI volumes")
+    preprocess.add_argument("cache_dir")
+    preprocess.add_argument("volume_dirs", nargs="+", help="Directories of CT volumes")
+    preprocess.add_argument("--masks", required=True, help="Directory of segmentations")
+    preprocess.add_argument("--size", type=int, default=256)
+    preprocess.add_argument("--shard-size", type=int, default=512, help="Slices per shard file")
+
+    info = commands.add_parser("describe", help="Summarise an existing slice cache")
+    info.add_argument("cache_dir")
+
+    args = parser.parse_args(argv)
+    if args.command == "preprocess":
+        pairs = find_volume_pairs(args.volume_dirs, args.masks)
+        preprocess_volumes(pairs, args.cache_dir, target_size=(args.size, args.size), shard_size=args.shard_size)
+    print(json.dumps(describe(SliceCache(args.cache_dir)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ("id", "fn", "args", "kwargs", "status", "result", "error",
+                 "created_at", "started_at", "finished_at", "done")
+
+    def __init__(self, fn, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def snapshot(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """Runs submitted callables on a fixed pool of worker threads.
+
+    At most ``max_queue`` jobs may wait for a worker; further submissions
+    raise ``JobQueueFull`` so callers can push back on clients. Finished jobs
+    are kept for ``result_ttl_seconds`` so their results can be polled.
+    """
+
+    def __init__(self, max_workers=2, max_queue=16, result_ttl_seconds=3600):
+        self.max_workers = max_workers
+        self.result_ttl_seconds = result_ttl_seconds
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._workers = []
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, fn, *args, **kwargs):
+        job = _Job(fn, args, kwargs)
+        with self._lock:
+            self._start_workers()
+            self._expire()
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self.rejected += 1
+                raise JobQueueFull("Too many analyses are queued, please retry shortly")
+            self._jobs[job.id] = job
+            self.submitted += 1
+        return job.id
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return job.snapshot() if job is not None else None
+
+    def wait(self, job_id, timeout=None):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job.done.wait(timeout)
+        return job.snapshot()
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == RUNNING)
+            return {
+                "workers": self.max_workers,
+                "queued": self._queue.qsize(),
+                "max_queue": self._queue.maxsize,
+                "running": running,
+                "tracked_jobs": len(self._jobs),
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+    def _start_workers(self):
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._run, name=f"job-worker-{len(self._workers)}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.status = RUNNING
+            job.started_at = time.time()
+            try:
+                job.result = job.fn(*job.args, **job.kwargs)
+                job.status = DONE
+            except Exception as e:
+                traceback.print_exc()
+                job.error = str(e)
+                job.status = FAILED
+            job.finished_at = time.time()
+            job.fn = job.args = job.kwargs = None
+            with self._lock:
+                if job.status == DONE:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            job.done.set()
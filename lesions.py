@@ -0,0 +1,209 @@
+import cv2
+import numpy as np
+
+
+def _ring(count):
+    """Unit directions evenly spread over half of the image plane."""
+    angles = np.pi * np.arange(count) / count
+    return np.stack([np.cos(angles), np.sin(angles), np.zeros(count)], axis=1)
+
+
+def _hemisphere(count):
+    """Roughly uniform unit directions with z > 0 (a Fibonacci lattice)."""
+    i = np.arange(count) + 0.5
+    z = 1 - i / count
+    r = np.sqrt(1 - z ** 2)
+    theta = np.pi * (1 + 5 ** 0.5) * i
+    return np.stack([r * np.cos(theta), r * np.sin(theta), z], axis=1)
+
+
+# Max diameters are measured as the largest extent along these directions;
+# 16 in-plane directions under-estimate by at most 1 - cos(pi/32) ~ 0.5%
+DIRECTIONS_2D = _ring(16)
+DIRECTIONS_3D = np.concatenate([DIRECTIONS_2D, _hemisphere(48)])
+
+# Per-component scalar columns kept by LesionLabeler
+_VOXELS, _SUM_X, _SUM_Y, _SUM_Z, _X0, _Y0, _Z0, _X1, _Y1, _Z1 = range(10)
+
+
+def _slice_components(binary):
+    """Label one slice and return its components with the coordinates of their edge pixels.
+
+    Only edge pixels can be extreme along any direction, so projecting them
+    is enough to find each component's max diameter.
+    """
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    interior = cv2.erode(binary, None, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    ys, xs = np.nonzero(binary & ~interior)
+    return count - 1, labels, stats[1:], centroids[1:], xs, ys, labels[ys, xs] - 1
+
+
+def _segment_reduce(values, order, starts, ufunc):
+    return ufunc.reduceat(values[order], starts, axis=0)
+
+
+class LesionLabeler:
+    """Labels 3D lesions from a stack of 2D masks, one slice at a time.
+
+    Each slice is labelled in 2D and only its per-component statistics and
+    the previous slice's label image are kept. Components that overlap the
+    component below them are joined with a union-find, so a full volume is
+    never held in memory. ``lesions()`` merges the statistics of joined
+    components in one vectorized pass.
+
+    ``spacing`` is (row, column, slice), the order of the volume's axes and
+    its header zooms.
+    """
+
+    def __init__(self, spacing=(1.0, 1.0, 1.0), threshold=0.5, directions=DIRECTIONS_3D):
+        self.spacing = np.asarray(spacing, dtype=np.float64)
+        self.threshold = threshold
+        self.directions = np.asarray(directions, dtype=np.float64)
+        self.component_lesion_ids = None
+
+        self._parent = []
+        self._scalars = []
+        self._proj_max = []
+        self._proj_min = []
+        self._previous = None
+        self._next_z = 0
+
+    def add_slice(self, mask, z=None):
+        """Add one 2D mask at slice index ``z`` (defaults to the slice after the last one).
+
+        Returns the slice's component map: the index of each pixel's
+        component, or -1 for background.
+        """
+        z = self._next_z if z is None else z
+        self._next_z = z + 1
+        binary = (np.asarray(mask).squeeze() > self.threshold).astype(np.uint8)
+        count, labels, stats, centroids, xs, ys, edge_labels = _slice_components(binary)
+
+        base = len(self._parent)
+        self._parent.extend(range(base, base + count))
+        components = np.where(labels > 0, labels.astype(np.int64) + (base - 1), -1)
+
+        if count:
+            area = stats[:, cv2.CC_STAT_AREA].astype(np.float64)
+            left = stats[:, cv2.CC_STAT_LEFT]
+            top = stats[:, cv2.CC_STAT_TOP]
+            scalars = np.empty((count, 10), dtype=np.float64)
+            scalars[:, _VOXELS] = area
+            scalars[:, _SUM_X] = centroids[:, 0] * area
+            scalars[:, _SUM_Y] = centroids[:, 1] * area
+            scalars[:, _SUM_Z] = z * area
+            scalars[:, _X0] = left
+            scalars[:, _Y0] = top
+            scalars[:, _X1] = left + stats[:, cv2.CC_STAT_WIDTH] - 1
+            scalars[:, _Y1] = top + stats[:, cv2.CC_STAT_HEIGHT] - 1
+            scalars[:, _Z0] = scalars[:, _Z1] = z
+            self._scalars.append(scalars)
+
+            # Project every edge pixel onto every direction, then take the
+            # per-component extremes with one sort and two reduceats
+            points = np.stack([ys, xs, np.full(len(xs), z)], axis=1) * self.spacing
+            projections = points @ self.directions.T
+            order = np.argsort(edge_labels, kind="stable")
+            starts = np.searchsorted(edge_labels[order], np.arange(count))
+            self._proj_max.append(_segment_reduce(projections, order, starts, np.maximum))
+            self._proj_min.append(_segment_reduce(projections, order, starts, np.minimum))
+
+            if self._previous is not None and self._previous[0] == z - 1:
+                below = self._previous[1]
+                overlap = (below >= 0) & (components >= 0)
+                if overlap.any():
+                    pairs = np.unique(below[overlap] * len(self._parent) + components[overlap])
+                    for a, b in zip(*np.divmod(pairs, len(self._parent))):
+                        self._union(int(a), int(b))
+
+        self._previous = (z, components)
+        return components
+
+    def lesions(self, min_voxels=1):
+        """Per-lesion statistics, largest first, with ids starting at 1."""
+        if not self._parent:
+            self.component_lesion_ids = np.zeros(0, dtype=np.int64)
+            return []
+
+        # Point every component straight at its root by pointer jumping
+        parent = np.asarray(self._parent, dtype=np.int64)
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        roots, root_index = np.unique(parent, return_inverse=True)
+
+        scalars = np.concatenate(self._scalars)
+        proj_max = np.concatenate(self._proj_max)
+        proj_min = np.concatenate(self._proj_min)
+        order = np.argsort(root_index, kind="stable")
+        starts = np.searchsorted(root_index[order], np.arange(len(roots)))
+
+        sums = _segment_reduce(scalars[:, :_X0], order, starts, np.add)
+        lows = _segment_reduce(scalars[:, _X0:_X1], order, starts, np.minimum)
+        highs = _segment_reduce(scalars[:, _X1:], order, starts, np.maximum)
+        extent = _segment_reduce(proj_max, order, starts, np.maximum) - \
+            _segment_reduce(proj_min, order, starts, np.minimum)
+        # Extents are between pixel centres; add the footprint of one voxel
+        voxel_width = np.abs(self.directions) @ self.spacing
+        diameters = (extent + voxel_width).max(axis=1)
+
+        voxels = sums[:, _VOXELS]
+        ranked = np.argsort(-voxels, kind="stable")
+        ranked = ranked[voxels[ranked] >= min_voxels]
+        lesion_ids = np.zeros(len(roots), dtype=np.int64)
+        lesion_ids[ranked] = np.arange(1, len(ranked) + 1)
+        self.component_lesion_ids = lesion_ids[root_index]
+
+        voxel_volume = float(np.prod(self.spacing))
+        lesions = []
+        for lesion_id, i in enumerate(ranked, start=1):
+            count = voxels[i]
+            lesions.append({
+                "id": lesion_id,
+                "voxels": int(count),
+                "volume": float(count * voxel_volume),
+                "max_diameter": float(diameters[i]),
+                "centroid": [float(sums[i, _SUM_X] / count), float(sums[i, _SUM_Y] / count),
+                             float(sums[i, _SUM_Z] / count)],
+                "bbox": {"x": [int(lows[i, 0]), int(highs[i, 0])],
+                         "y": [int(lows[i, 1]), int(highs[i, 1])],
+                         "z": [int(lows[i, 2]), int(highs[i, 2])]},
+            })
+        return lesions
+
+    def _find(self, a):
+        parent = self._parent
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    def _union(self, a, b):
+        a, b = self._find(a), self._find(b)
+        if a != b:
+            self._parent[max(a, b)] = min(a, b)
+
+
+def label_lesions_2d(mask, spacing=(1.0, 1.0, 1.0), threshold=0.5):
+    """Label the lesions of a single 2D mask.
+
+    Returns ``(labels, lesions)`` where ``labels`` holds each pixel's lesion
+    id (0 for background) and every lesion also carries its ``area``.
+    """
+    labeler = LesionLabeler(spacing, threshold, directions=DIRECTIONS_2D)
+    components = labeler.add_slice(mask)
+    lesions = labeler.lesions()
+    # Background (-1) maps to lesion 0
+    labels = np.concatenate(([0], labeler.component_lesion_ids))[components + 1]
+    for lesion in lesions:
+        lesion["area"] = float(lesion["voxels"] * spacing[0] * spacing[1])
+    return labels, lesions
+
+
+def lesion_summary(lesions):
+    return {
+        "lesion_count": len(lesions),
+        "largest_lesion_diameter": max((lesion["max_diameter"] for lesion in lesions), default=0.0),
+    }
@@ -0,0 +1,238 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers cheap stages (a few ms) up to slow CPU forward passes
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_local = threading.local()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames) or any(name not in labels for name in self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that can go up and down.
+
+    ``set_function`` makes the gauge read its value at scrape time instead,
+    which is how existing ``stats()`` dictionaries are exposed.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn):
+        self._function = fn
+
+    def _samples(self):
+        if self._function is not None:
+            return [f"{self.name} {_number(self._function())}"]
+        return super()._samples()
+
+
+class CounterFunction(_Metric):
+    """A counter whose value is read from a callable at scrape time."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, fn):
+        super().__init__(name, documentation)
+        self._function = fn
+
+    def _samples(self):
+        return [f"{self.name} {_number(self._function())}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, sum, count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, ('le', _number(bound)))} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Holds metrics and renders them in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def counter_function(self, name, documentation, fn):
+        return self.register(CounterFunction(name, documentation, fn))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def gauge_function(self, name, documentation, fn):
+        gauge = self.register(Gauge(name, documentation))
+        gauge.set_function(fn)
+        return gauge
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    """Times named stages into a histogram labelled by ``stage``.
+
+    While a profile is active on the current thread (see ``start_profile``)
+    the same durations are also summed into that profile, so a single
+    request or job can report its own breakdown.
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.histogram.observe(elapsed, stage=name)
+            timings = getattr(_local, "timings", None)
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def start_profile():
+    """Start collecting stage timings on this thread; returns the dict they are written to."""
+    _local.timings = {}
+    return _local.timings
+
+
+def stop_profile():
+    timings = getattr(_local, "timings", None)
+    _local.timings = None
+    return timings
+
+
+@contextmanager
+def profile():
+    previous = getattr(_local, "timings", None)
+    timings = start_profile()
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+def server_timing(timings):
+    """Format stage timings (seconds) as a ``Server-Timing`` header value in milliseconds."""
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
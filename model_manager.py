@@ -0,0 +1,148 @@
+import threading
+import time
+
+import numpy as np
+
+from prediction_cache import file_digest
+
+UNLOADED = "unloaded"
+LOADING = "loading"
+WARMING_UP = "warming_up"
+READY = "ready"
+FAILED = "failed"
+
+BACKENDS = ("keras", "tflite", "server")
+
+
+class ModelManager:
+    """Owns the segmentation model and its load / warm-up lifecycle.
+
+    TensorFlow is only imported when the model is first loaded, either in a
+    background thread (``start``) or lazily on the first ``get``. Loading is
+    followed by a warm-up pass per batch size in ``warmup_batch_sizes`` so the
+    first real request does not pay for graph tracing.
+
+    With the ``server`` backend ``model_path`` is the socket of a running
+    model_server.py; the model lives in that process and this one never
+    imports TensorFlow.
+    """
+
+    def __init__(self, model_path, version=None, warmup_batch_sizes=(1,), input_shape=(256, 256, 1),
+                 backend="keras", num_threads=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend: {backend}")
+        self.model_path = model_path
+        self.backend = backend
+        self.num_threads = num_threads
+        self.warmup_batch_sizes = tuple(warmup_batch_sizes)
+        self.input_shape = tuple(input_shape)
+
+        self.state = UNLOADED
+        self.error = None
+        self.timings = {}
+        self.loaded_at = None
+
+        self._version = version
+        self._model = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    @property
+    def version(self):
+        if self._version is None:
+            with self._lock:
+                if self._version is None and self.backend == "server":
+                    from model_server import ModelServerClient
+
+                    # The server owns the model file, so it reports the version
+                    client = ModelServerClient(self.model_path)
+                    try:
+                        self._version = client.wait_until_ready()["model_version"]
+                    finally:
+                        client.close()
+                elif self._version is None:
+                    self._version = file_digest(self.model_path)[:12]
+        return self._version
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, name="model-loader", daemon=True)
+                self._thread.start()
+        return self
+
+    def load(self):
+        self.start()
+        self._thread.join()
+        return self
+
+    def get(self, timeout=None):
+        self.start()
+        if not self._ready.wait(timeout):
+            raise TimeoutError("Timed out waiting for the model to load")
+        if self.state == FAILED:
+            raise RuntimeError(f"Model failed to load: {self.error}")
+        return self._model
+
+    def predict(self, batch):
+        return self.get().predict_on_batch(batch)
+
+    def is_ready(self):
+        return self.state == READY
+
+    def status(self):
+        return {
+            "state": self.state,
+            "model_path": self.model_path,
+            "backend": self.backend,
+            "version": self._version,
+            "error": self.error,
+            "loaded_at": self.loaded_at,
+            "timings": dict(self.timings),
+        }
+
+    def _timed(self, name, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        self.timings[name] = time.perf_counter() - started
+        return result
+
+    def _load(self):
+        self.state = LOADING
+        try:
+            self._timed("version", lambda: self.version)
+            if self.backend == "server":
+                from model_server import ModelServerClient
+
+                max_batch_size = max(self.warmup_batch_sizes, default=1)
+                model = self._timed("load_model", ModelServerClient, self.model_path, 60.0, max_batch_size,
+                                    self.input_shape)
+            elif self.backend == "tflite":
+                from tflite_backend import TFLiteModel
+                model = self._timed("load_model", TFLiteModel, self.model_path, self.num_threads)
+            else:
+                tf = self._timed("import_tensorflow", _import_tensorflow)
+                model = self._timed("load_model", tf.keras.models.load_model, self.model_path)
+
+            self.state = WARMING_UP
+            for batch_size in self.warmup_batch_sizes:
+                dummy = np.zeros((batch_size,) + self.input_shape, dtype=np.float32)
+                self._timed(f"warmup_batch_{batch_size}", model.predict_on_batch, dummy)
+
+            self._model = model
+            self.loaded_at = time.time()
+            self.state = READY
+            print(f"Model {self.version} ready: " +
+                  ", ".join(f"{name}={seconds:.2f}s" for name, seconds in self.timings.items()))
+        except Exception as e:
+            self.error = str(e)
+            self.state = FAILED
+            print(f"Error loading model from {self.model_path}: {str(e)}")
+        finally:
+            self._ready.set()
+
+
+def _import_tensorflow():
+    import tensorflow as tf
+    return tf
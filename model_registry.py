@@ -0,0 +1,287 @@
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from batching import BatchingInferenceEngine
+from model_manager import FAILED, READY, ModelManager
+
+
+class ModelVersion:
+    """One loaded model with its own batching engine and latency record.
+
+    Requests queued on the engine always run on this model, so swapping
+    the active version never moves an in-flight request to another model.
+    """
+
+    def __init__(self, manager, max_batch_size=8, max_wait_ms=5, latency_window=1000, latency_histogram=None):
+        self.manager = manager
+        self.engine = BatchingInferenceEngine(manager.predict, max_batch_size=max_batch_size,
+                                              max_wait_ms=max_wait_ms)
+        self.latency_histogram = latency_histogram
+        self.registered_at = time.time()
+        self.in_flight = 0
+        self.retired = False
+
+        self.requests = 0
+        self.rows = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self.manager.version
+
+    @property
+    def label(self):
+        # Unlike ``version`` this never blocks; None until the loader has hashed the model
+        return self.manager.status()["version"]
+
+    def predict(self, batch):
+        started = time.perf_counter()
+        try:
+            result = self.engine.predict(batch)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.requests += 1
+            self.rows += len(batch)
+            self._latencies.append(elapsed)
+        if self.latency_histogram is not None:
+            self.latency_histogram.observe(elapsed, version=self.version)
+        return result
+
+    def latency(self):
+        with self._lock:
+            latencies = np.array(self._latencies)
+        if not len(latencies):
+            return {"samples": 0}
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        return {"samples": len(latencies), "mean_ms": float(latencies.mean() * 1000),
+                "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+    def stats(self):
+        return {
+            "version": self.label,
+            "status": self.manager.status(),
+            "registered_at": self.registered_at,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "rows": self.rows,
+            "errors": self.errors,
+            "latency": self.latency(),
+            "engine": self.engine.stats(),
+        }
+
+    def close(self):
+        self.engine.close()
+
+
+class ModelRegistry:
+    """Model versions that can be loaded, swapped and canaried without a restart.
+
+    Requests take a version with ``acquire`` and keep it until they are
+    done, so the cache key, the mask and the stamped version always agree.
+    ``load`` brings up a new version in the background (load and warm-up)
+    and can activate it once it is ready. Activation is a pointer swap
+    between requests; the previous version finishes its in-flight requests
+    and is then unloaded. With a canary set, ``canary_fraction`` of the
+    requests go to the candidate version instead of the active one.
+    """
+
+    def __init__(self, max_batch_size=8, max_wait_ms=5, warmup_batch_sizes=(1,), latency_histogram=None):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.warmup_batch_sizes = tuple(warmup_batch_sizes)
+        self.latency_histogram = latency_histogram
+
+        self._versions = []
+        self._active = None
+        self._canary = None
+        self._canary_fraction = 0.0
+        self._swaps = deque(maxlen=20)
+        self._lock = threading.Lock()
+
+    def register(self, manager):
+        """Add a version for an existing ModelManager; the first one becomes active straight away.
+
+        Version labels are how the admin API addresses models, so they must
+        be unique. Every model after the first has its version worked out
+        here (hashing the file, or asking the model server), and a version
+        that is already registered raises ValueError.
+        """
+        label = None
+        if self._versions:
+            label = manager.version
+            # The first model may still be loading lazily without a label
+            for other in list(self._versions):
+                other.version
+        with self._lock:
+            if label is not None and any(other.label == label for other in self._versions):
+                raise ValueError(f"Model version {label} is already registered")
+            entry = ModelVersion(manager, self.max_batch_size, self.max_wait_ms,
+                                 latency_histogram=self.latency_histogram)
+            self._versions.append(entry)
+            if self._active is None:
+                self._active = entry
+        return entry
+
+    def load(self, model_path, version=None, backend="keras", num_threads=None, activate=False,
+             canary_fraction=None):
+        """Load and warm up a model in the background.
+
+        Once it is ready it is activated, or made the canary when
+        ``canary_fraction`` is given. A model that fails to load is left
+        in the registry in the failed state so ``stats`` shows the error.
+        A version that is already registered raises ValueError.
+        """
+        manager = ModelManager(model_path, version=version, warmup_batch_sizes=self.warmup_batch_sizes,
+                               backend=backend, num_threads=num_threads)
+        entry = self.register(manager)
+        manager.start()
+        if activate or canary_fraction is not None:
+            threading.Thread(target=self._deploy_when_ready, args=(entry, activate, canary_fraction),
+                             name="model-deploy", daemon=True).start()
+        return entry
+
+    def active(self):
+        return self._active
+
+    @contextmanager
+    def acquire(self):
+        """The version a request should use from start to finish."""
+        with self._lock:
+            entry = self._active
+            if self._canary is not None and random.random() < self._canary_fraction:
+                entry = self._canary
+            entry.in_flight += 1
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.in_flight -= 1
+                drained = entry.retired and entry.in_flight == 0
+            if drained:
+                entry.close()
+
+    def activate(self, version):
+        entry = self._ready_version(version)
+        with self._lock:
+            self._check_registered(entry)
+            previous = self._active
+            if entry is previous:
+                return entry
+            self._active = entry
+            if self._canary is entry:
+                self._canary = None
+                self._canary_fraction = 0.0
+            self._swaps.append({"version": entry.version, "previous": previous.version,
+                                "activated_at": time.time()})
+        print(f"Model {entry.version} is now active (was {previous.version})")
+        self._retire(previous)
+        return entry
+
+    def set_canary(self, version, fraction):
+        if not 0 <= fraction <= 1:
+            raise ValueError("The canary fraction must be between 0 and 1")
+        entry = self._ready_version(version)
+        with self._lock:
+            self._check_registered(entry)
+            if entry is self._active:
+                raise ValueError(f"Model {entry.label} is already active")
+            self._canary = entry
+            self._canary_fraction = fraction
+        return entry
+
+    def clear_canary(self):
+        with self._lock:
+            self._canary = None
+            self._canary_fraction = 0.0
+
+    def unload(self, version):
+        entry = self._find(version)
+        with self._lock:
+            if entry is self._active:
+                raise ValueError(f"Model {version} is active and can't be unloaded")
+            if entry is self._canary:
+                self._canary = None
+                self._canary_fraction = 0.0
+        self._retire(entry)
+
+    # The active version, for callers that don't need a stable version per request
+    @property
+    def version(self):
+        return self._active.version
+
+    def predict(self, batch):
+        return self._active.predict(batch)
+
+    def is_ready(self):
+        return self._active.manager.is_ready()
+
+    def status(self):
+        return self._active.manager.status()
+
+    def stats(self):
+        with self._lock:
+            versions = list(self._versions)
+            active, canary, fraction = self._active, self._canary, self._canary_fraction
+            swaps = list(self._swaps)
+        stats = {
+            "active": active.label,
+            "canary": canary.label if canary is not None else None,
+            "canary_fraction": fraction,
+            "versions": [entry.stats() for entry in versions],
+            "swaps": swaps,
+        }
+        if canary is not None:
+            baseline, candidate = active.latency(), canary.latency()
+            if baseline["samples"] and candidate["samples"]:
+                stats["canary_latency_ratio"] = {key: candidate[key] / baseline[key]
+                                                 for key in ("mean_ms", "p50_ms", "p95_ms") if baseline[key]}
+        return stats
+
+    def _find(self, version):
+        for entry in self._versions:
+            if entry.label == version:
+                return entry
+        raise KeyError(f"Unknown model version: {version}")
+
+    def _ready_version(self, version):
+        entry = version if isinstance(version, ModelVersion) else self._find(version)
+        if entry.manager.state != READY:
+            raise ValueError(f"Model {entry.label} is not ready ({entry.manager.state})")
+        return entry
+
+    def _check_registered(self, entry):
+        # Called under the lock: an entry unloaded meanwhile has a closed engine and can't serve
+        if entry.retired or entry not in self._versions:
+            raise ValueError(f"Model {entry.label} has been unloaded")
+
+    def _retire(self, entry):
+        with self._lock:
+            if entry in self._versions:
+                self._versions.remove(entry)
+            entry.retired = True
+            drained = entry.in_flight == 0
+        if drained:
+            entry.close()
+
+    def _deploy_when_ready(self, entry, activate, canary_fraction):
+        entry.manager.load()
+        if entry.manager.state == FAILED:
+            return
+        try:
+            if activate:
+                self.activate(entry)
+            else:
+                self.set_canary(entry, canary_fraction)
+        except ValueError as e:
+            print(f"Not deploying model {entry.label}: {e}")
@@ -0,0 +1,454 @@
+"""Local model server that owns the segmentation model for all web workers.
+
+A supervisor process forks ``--workers`` model processes that share one
+Unix socket. Clients send small JSON control messages over the socket and
+pass tensors through shared memory, so arrays are never pickled or copied
+through the socket. Crashed or hung workers are restarted::
+
+    python model_server.py serve --socket /tmp/liver-model.sock --workers 2
+    python model_server.py serve --socket /tmp/liver-model.sock --fake
+    python model_server.py health --socket /tmp/liver-model.sock
+
+Web workers then use it with ``INFERENCE_BACKEND=server``.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import weakref
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+
+# Per-worker slots in the shared health array; its last element counts restarts
+_HEARTBEAT, _BUSY_SINCE, _REQUESTS, _ERRORS = range(4)
+_HEALTH_FIELDS = 4
+
+
+class FakeModel:
+    """Stand-in for the UNet: thresholds the input instead of running a network."""
+
+    version = "fake"
+
+    def __init__(self, threshold=0.5, latency_ms=0.0):
+        self.threshold = threshold
+        self.latency = latency_ms / 1000.0
+
+    def predict_on_batch(self, batch):
+        if self.latency:
+            time.sleep(self.latency * len(batch))
+        return (np.asarray(batch) > self.threshold).astype(np.float32)
+
+
+def _attach_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the segment with this
+        # process's resource tracker, which would unlink it on exit
+        from multiprocessing import resource_tracker
+
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class _Worker:
+    """One model process: accepts connections on the shared listening socket."""
+
+    def __init__(self, index, listener, options, health):
+        self.index = index
+        self.listener = listener
+        self.options = options
+        self.health = health
+        self.requests = 0
+        self.errors = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def run(self):
+        from batching import BatchingInferenceEngine
+
+        # Forked workers inherit the supervisor's handlers; it alone handles Ctrl+C
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # Beat while loading too, or a slow TensorFlow import looks like a hang
+        threading.Thread(target=self._heartbeat, name="heartbeat", daemon=True).start()
+        self.model, self.version = self._load_model()
+        self.engine = BatchingInferenceEngine(self.model.predict_on_batch,
+                                              max_batch_size=self.options.max_batch_size,
+                                              max_wait_ms=self.options.max_wait_ms)
+        print(f"Model worker {self.index} (pid {os.getpid()}) serving model {self.version}", flush=True)
+        while True:
+            conn, _ = self.listener.accept()
+            threading.Thread(target=self._serve, args=(conn,), name="model-connection", daemon=True).start()
+
+    def _load_model(self):
+        options = self.options
+        if options.fake:
+            model = FakeModel(latency_ms=options.fake_latency_ms)
+            return model, model.version
+
+        from model_manager import ModelManager
+
+        manager = ModelManager(options.model, version=options.version,
+                               warmup_batch_sizes=(1, options.max_batch_size),
+                               backend=options.backend, num_threads=options.num_threads).load()
+        return manager.get(), manager.version
+
+    def _heartbeat(self):
+        base = self.index * _HEALTH_FIELDS
+        while True:
+            with self._lock:
+                busy_since = min(self._in_flight.values(), default=0.0)
+            self.health[base + _HEARTBEAT] = time.time()
+            self.health[base + _BUSY_SINCE] = busy_since
+            self.health[base + _REQUESTS] = self.requests
+            self.health[base + _ERRORS] = self.errors
+            time.sleep(1.0)
+
+    def _serve(self, conn):
+        segments = {}
+        stream = conn.makefile("rwb")
+        try:
+            for line in stream:
+                request = json.loads(line)
+                try:
+                    reply = self._handle(request, segments)
+                except Exception as e:
+                    self.errors += 1
+                    reply = {"ok": False, "error": str(e)}
+                stream.write(json.dumps(reply).encode() + b"\n")
+                stream.flush()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            for shm in segments.values():
+                shm.close()
+            stream.close()
+            conn.close()
+
+    def _handle(self, request, segments):
+        op = request.get("op")
+        if op == "health":
+            workers = (len(self.health) - 1) // _HEALTH_FIELDS
+            now = time.time()
+            alive = sum(now - self.health[i * _HEALTH_FIELDS + _HEARTBEAT] < 5 for i in range(workers))
+            return {"ok": True, "worker": self.index, "pid": os.getpid(), "model_version": self.version,
+                    "requests": self.requests, "errors": self.errors, "engine": self.engine.stats(),
+                    "pool": {"workers": workers, "alive": alive, "restarts": int(self.health[-1])}}
+        if op != "predict":
+            raise ValueError(f"Unknown operation: {op}")
+
+        name = request["shm"]
+        shm = segments.get(name)
+        if shm is None:
+            shm = segments[name] = _attach_shared_memory(name)
+        shape = tuple(request["shape"])
+        output_offset = request["output_offset"]
+
+        key = object()
+        with self._lock:
+            self._in_flight[key] = time.time()
+        try:
+            inputs = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+            masks = np.asarray(self.engine.predict(inputs.copy()), dtype=np.float32)
+            del inputs
+            if output_offset + masks.nbytes > shm.size:
+                raise ValueError(f"Output of shape {masks.shape} does not fit the shared memory segment")
+            outputs = np.ndarray(masks.shape, dtype=np.float32, buffer=shm.buf, offset=output_offset)
+            outputs[...] = masks
+            del outputs
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        self.requests += 1
+        return {"ok": True, "shape": list(masks.shape)}
+
+
+def _worker_main(index, listener, options, health):
+    _Worker(index, listener, options, health).run()
+
+
+class ModelServer:
+    """Supervisor that keeps ``workers`` model processes running.
+
+    Workers are forked with the listening socket already open, so the
+    kernel spreads connections between them. A worker that exits is
+    restarted, with a growing delay if it keeps crashing; one whose
+    oldest request has run for more than ``request_timeout`` seconds or
+    whose heartbeat stops is killed and restarted.
+    """
+
+    def __init__(self, socket_path, options, workers=1, request_timeout=60.0, heartbeat_timeout=30.0):
+        self.socket_path = socket_path
+        self.options = options
+        self.workers = workers
+        self.request_timeout = request_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+
+        # Forking keeps the listening socket shared; the supervisor never imports TensorFlow
+        self._context = multiprocessing.get_context("fork")
+        self._health = self._context.Array("d", workers * _HEALTH_FIELDS + 1, lock=False)
+        self._processes = [None] * workers
+        self._started_at = [0.0] * workers
+        self._failures = [0] * workers
+        self._stopping = False
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        self.listener.listen(128)
+        self._socket_inode = os.stat(self.socket_path).st_ino
+        print(f"Model server listening on {self.socket_path} with {self.workers} worker(s)", flush=True)
+
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        try:
+            for index in range(self.workers):
+                self._spawn(index)
+            while not self._stopping:
+                sentinels = [p.sentinel for p in self._processes if p is not None]
+                wait(sentinels, timeout=1.0)
+                self._check_workers()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._shutdown()
+
+    def stop(self):
+        self._stopping = True
+
+    def _spawn(self, index):
+        base = index * _HEALTH_FIELDS
+        self._health[base:base + _HEALTH_FIELDS] = [time.time(), 0.0, 0.0, 0.0]
+        process = self._context.Process(target=_worker_main, name=f"model-worker-{index}",
+                                        args=(index, self.listener, self.options, self._health), daemon=True)
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+
+    def _check_workers(self):
+        now = time.time()
+        for index, process in enumerate(self._processes):
+            if self._stopping:
+                return
+            base = index * _HEALTH_FIELDS
+            if process.is_alive():
+                busy_since = self._health[base + _BUSY_SINCE]
+                if busy_since and now - busy_since > self.request_timeout:
+                    print(f"Model worker {index} stuck on a request for {now - busy_since:.0f}s, killing it",
+                          flush=True)
+                    process.kill()
+                elif now - self._health[base + _HEARTBEAT] > self.heartbeat_timeout:
+                    print(f"Model worker {index} missed its heartbeat, killing it", flush=True)
+                    process.kill()
+                continue
+
+            process.join()
+            uptime = time.monotonic() - self._started_at[index]
+            # Back off when a worker dies right after starting (e.g. the model fails to load)
+            self._failures[index] = self._failures[index] + 1 if uptime < 30 else 0
+            delay = min(2 ** self._failures[index] - 1, 30)
+            print(f"Model worker {index} exited with code {process.exitcode}, restarting in {delay}s", flush=True)
+            if delay:
+                time.sleep(delay)
+            self._health[-1] += 1
+            self._spawn(index)
+
+    def _shutdown(self):
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join(5)
+        self.listener.close()
+        # Leave the path alone if another server has since bound it
+        if os.path.exists(self.socket_path) and os.stat(self.socket_path).st_ino == self._socket_inode:
+            os.unlink(self.socket_path)
+
+
+class _Connection:
+    def __init__(self, socket_path, timeout):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.stream = self.sock.makefile("rwb")
+        self.shm = None
+
+    def request(self, message):
+        self.stream.write(json.dumps(message).encode() + b"\n")
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("Model server closed the connection")
+        reply = json.loads(line)
+        if not reply.get("ok"):
+            raise RuntimeError(f"Model server error: {reply.get('error')}")
+        return reply
+
+    def segment(self, nbytes):
+        # Each connection owns one segment: input first, output after it
+        if self.shm is None or self.shm.size < 2 * nbytes:
+            self.release()
+            self.shm = shared_memory.SharedMemory(create=True, size=2 * nbytes)
+        return self.shm
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        self.release()
+        try:
+            self.stream.close()
+        except OSError:
+            pass
+        finally:
+            self.sock.close()
+
+
+def _close_connections(connections):
+    for connection in connections:
+        connection.close()
+    connections.clear()
+
+
+class ModelServerClient:
+    """Talks to a ModelServer; a drop-in for a Keras model's ``predict_on_batch``.
+
+    Each call borrows an idle connection from a small pool (or opens one).
+    Every connection has its own shared memory segment, sized for
+    ``max_batch_size`` slices and grown when a larger batch arrives. A
+    request that fails because its worker died is retried once on a new
+    connection.
+    """
+
+    def __init__(self, socket_path, timeout=60.0, max_batch_size=8, input_shape=(256, 256, 1)):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.max_batch_size = max_batch_size
+        self.input_shape = tuple(input_shape)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._version = None
+        # Unlink the shared memory segments at exit even if close() is never called
+        weakref.finalize(self, _close_connections, self._idle)
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = self.health()["model_version"]
+        return self._version
+
+    def predict_on_batch(self, batch):
+        return self._call(self._predict, np.ascontiguousarray(batch, dtype=np.float32))
+
+    predict = predict_on_batch
+
+    def health(self):
+        return self._call(lambda connection: connection.request({"op": "health"}))
+
+    def wait_until_ready(self, timeout=60.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.health()
+            except (ConnectionError, OSError):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Model server at {self.socket_path} is not responding")
+                time.sleep(0.2)
+
+    def close(self):
+        with self._lock:
+            _close_connections(self._idle)
+
+    def _call(self, fn, *args):
+        for attempt in range(2):
+            with self._lock:
+                connection = self._idle.pop() if self._idle and not attempt else None
+            try:
+                if connection is None:
+                    connection = _Connection(self.socket_path, self.timeout)
+                result = fn(connection, *args)
+            except (ConnectionError, OSError):
+                if connection is not None:
+                    connection.close()
+                if attempt:
+                    raise
+                # The worker behind this connection is gone and other idle
+                # connections may point at it too; retry once on a fresh one
+                self.close()
+                continue
+            except BaseException:
+                connection.close()
+                raise
+            with self._lock:
+                self._idle.append(connection)
+            return result
+
+    def _predict(self, connection, batch):
+        capacity = max(batch.nbytes, self.max_batch_size * int(np.prod(self.input_shape)) * 4)
+        shm = connection.segment(capacity)
+        inputs = np.ndarray(batch.shape, dtype=np.float32, buffer=shm.buf)
+        inputs[...] = batch
+        del inputs
+        output_offset = shm.size // 2
+        reply = connection.request({"op": "predict", "shm": shm.name, "shape": list(batch.shape),
+                                    "output_offset": output_offset})
+        outputs = np.ndarray(tuple(reply["shape"]), dtype=np.float32, buffer=shm.buf, offset=output_offset)
+        masks = outputs.copy()
+        del outputs
+        return masks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Run the model server")
+    serve.add_argument("--socket", default="/tmp/liver-model.sock")
+    serve.add_argument("--workers", type=int, default=1, help="Model processes, each with its own copy")
+    serve.add_argument("--model", default=os.environ.get("MODEL_PATH", "liver_tumor_segmentation_final.keras"))
+    serve.add_argument("--backend", choices=("keras", "tflite"), default="keras")
+    serve.add_argument("--version", default=os.environ.get("MODEL_VERSION"),
+                       help="Model version reported to clients (defaults to a hash of the model file)")
+    serve.add_argument("--num-threads", type=int, help="TFLite interpreter threads")
+    serve.add_argument("--max-batch-size", type=int, default=8)
+    serve.add_argument("--max-wait-ms", type=float, default=5.0)
+    serve.add_argument("--request-timeout", type=float, default=60.0,
+                       help="Restart a worker stuck on one request for this long")
+    serve.add_argument("--fake", action="store_true", help="Threshold the input instead of loading the model")
+    serve.add_argument("--fake-latency-ms", type=float, default=0.0, help="Per-slice delay of the fake model")
+
+    health = commands.add_parser("health", help="Check that the server answers")
+    health.add_argument("--socket", default="/tmp/liver-model.sock")
+    health.add_argument("--timeout", type=float, default=5.0)
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        ModelServer(args.socket, args, workers=args.workers, request_timeout=args.request_timeout).serve_forever()
+    else:
+        client = ModelServerClient(args.socket, timeout=args.timeout)
+        try:
+            health = client.health()
+        except (ConnectionError, OSError, RuntimeError) as e:
+            print(f"Model server at {args.socket} is not healthy: {str(e)}")
+            sys.exit(1)
+        finally:
+            client.close()
+        print(json.dumps(health, indent=2))
+
+
+if __name__ == "__main__":
+    main()
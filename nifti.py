@@ -0,0 +1,121 @@
+import os
+
+import cv2
+import numpy as np
+
+from lesions import LesionLabeler, lesion_summary
+
+NIFTI_EXTENSIONS = (".nii", ".nii.gz")
+
+
+def is_nifti_filename(filename):
+    return filename.lower().endswith(NIFTI_EXTENSIONS)
+
+
+def nifti_suffix(filename):
+    return ".nii.gz" if filename.lower().endswith(".nii.gz") else os.path.splitext(filename)[1]
+
+
+def preprocess_slice(slice_img, target_size=(256, 256), out=None):
+    # Same normalisation as load_and_preprocess_nifti in the training notebook:
+    # min-max to 0-255, resize, then scale to [0, 1]
+    slice_img = cv2.normalize(slice_img, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_32F)
+    slice_img = cv2.resize(slice_img, target_size)
+    if out is None:
+        return slice_img * np.float32(1 / 255.0)
+    np.multiply(slice_img, np.float32(1 / 255.0), out=out)
+    return out
+
+
+def load_nifti(path):
+    """Open a NIfTI file for slice-by-slice reads through its array proxy.
+
+    The file stays open between reads. Otherwise every slice of a .nii.gz
+    reopens the gzip stream and decompresses from the start, which makes
+    reading a volume quadratic in its number of slices.
+    """
+    import nibabel as nib
+
+    return nib.load(path, mmap=True, keep_file_open=True)
+
+
+def iter_nifti_slices(image):
+    # Slices are read one at a time through the array proxy, so the whole
+    # volume is never materialised in memory
+    proxy = image.dataobj
+    for z in range(image.shape[2]):
+        slice_img = np.asarray(proxy[:, :, z], dtype=np.float32)
+        if slice_img.ndim > 2:
+            slice_img = slice_img[..., 0]
+        yield z, slice_img
+
+
+def analyze_nifti_volume(path, predict_fn, batch_size=8, target_size=(256, 256), slice_filter=None):
+    image = load_nifti(path)
+    if len(image.shape) < 3:
+        raise ValueError(f"Expected a 3D volume, got shape {image.shape}")
+
+    rows, cols, depth = image.shape[:3]
+    zooms = image.header.get_zooms()
+    spacing = tuple(float(z) for z in zooms[:3]) + (1.0,) * (3 - len(zooms[:3]))
+
+    # Slices are resized before inference, so each model pixel covers a
+    # larger (or smaller) in-plane area than the native voxel
+    model_spacing = (spacing[0] * rows / target_size[1],
+                     spacing[1] * cols / target_size[0],
+                     spacing[2])
+    voxel_volume = model_spacing[0] * model_spacing[1] * model_spacing[2]
+
+    batch = np.empty((batch_size, target_size[1], target_size[0], 1), dtype=np.float32)
+    batch_slices = []
+    per_slice_tumor_voxels = [0] * depth
+    # Slices reach the labeler in z order, so lesions are joined across
+    # slices without keeping the predicted masks around
+    labeler = LesionLabeler(spacing=model_spacing)
+    skipped_slices = []
+
+    def flush():
+        if slice_filter is not None:
+            # Slices the pre-filter rejects keep an empty mask
+            mask, skipped = slice_filter.predict(batch[:len(batch_slices)], predict_fn)
+            skipped_slices.extend(z for z, skip in zip(batch_slices, skipped) if skip)
+        else:
+            mask = predict_fn(batch[:len(batch_slices)])
+        counts = np.count_nonzero(mask.reshape(len(batch_slices), -1) > 0.5, axis=1)
+        for i, (z, count) in enumerate(zip(batch_slices, counts)):
+            per_slice_tumor_voxels[z] = int(count)
+            labeler.add_slice(mask[i], z)
+        batch_slices.clear()
+
+    slices_analyzed = 0
+    for z, slice_img in iter_nifti_slices(image):
+        # Skip empty slices, as the notebook does during training
+        if np.max(slice_img) == 0:
+            continue
+        preprocess_slice(slice_img, target_size, out=batch[len(batch_slices), :, :, 0])
+        batch_slices.append(z)
+        slices_analyzed += 1
+        if len(batch_slices) == batch_size:
+            flush()
+    if batch_slices:
+        flush()
+
+    tumor_voxels = sum(per_slice_tumor_voxels)
+    analyzed_voxels = slices_analyzed * target_size[0] * target_size[1]
+    lesions = labeler.lesions()
+    return {
+        "shape": [int(s) for s in image.shape],
+        "spacing": list(spacing),
+        "model_spacing": list(model_spacing),
+        "slices": depth,
+        "slices_analyzed": slices_analyzed,
+        "slices_skipped": len(skipped_slices),
+        "skipped_slices": skipped_slices,
+        "tumor_slices": sum(1 for count in per_slice_tumor_voxels if count),
+        "tumor_voxels": tumor_voxels,
+        "tumor_percentage": (tumor_voxels / analyzed_voxels) * 100 if analyzed_voxels else 0.0,
+        "volume": tumor_voxels * voxel_volume,
+        "per_slice_tumor_voxels": per_slice_tumor_voxels,
+        "lesions": lesions,
+        **lesion_summary(lesions),
+    }
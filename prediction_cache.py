@@ -0,0 +1,131 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# Rough allowance for the disease info dict and bookkeeping of each entry
+_ENTRY_OVERHEAD = 4096
+
+
+def prediction_key(image_bytes, model_version):
+    digest = hashlib.sha256()
+    digest.update(str(model_version).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _entry_size(entry):
+    return len(entry["mask"]) + len(entry["overlay_png"]) + _ENTRY_OVERHEAD
+
+
+class PredictionCache:
+    """Content-addressed cache of model outputs and their derived artifacts.
+
+    Entries live in an in-memory LRU bounded by ``max_bytes``. When
+    ``disk_dir`` is set every entry is also written there, so entries evicted
+    from memory (or written by another worker) can still be served.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._insert(key, entry)
+        return entry
+
+    def put(self, key, mask, mask_shape, disease_info, overlay_png):
+        entry = {
+            "mask": mask,
+            "mask_shape": tuple(mask_shape),
+            "disease_info": disease_info,
+            "overlay_png": overlay_png,
+        }
+        with self._lock:
+            self._insert(key, entry)
+        self._write_disk(key, entry)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_dir": self.disk_dir,
+            }
+
+    def _insert(self, key, entry):
+        size = _entry_size(entry)
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= _entry_size(previous)
+        self._entries[key] = entry
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= _entry_size(evicted)
+            self.evictions += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".pkl")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _write_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary name first so readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
@@ -0,0 +1,247 @@
+"""Cheap pre-filter that decides whether a slice needs the segmentation model.
+
+Blank or near-black slices are always skipped by intensity rules. A tiny
+logistic-regression classifier over low-resolution features can be trained
+on a slice cache (see data_pipeline.py) to also skip slices without liver,
+with its threshold chosen for a target liver recall::
+
+    python prefilter.py train slice_cache prefilter.npz --recall 0.995
+    python prefilter.py evaluate slice_cache prefilter.npz --model liver_tumor_segmentation_final.keras
+"""
+import argparse
+import hashlib
+import json
+import time
+
+import cv2
+import numpy as np
+
+FEATURE_GRID = 8
+HISTOGRAM_BINS = 8
+# The intensity rules look at every RULE_STRIDE-th pixel in each direction
+RULE_STRIDE = 4
+
+
+def slice_features(batch):
+    """Features of (N, H, W[, 1]) slices in [0, 1]: global stats, a histogram and an 8x8 thumbnail."""
+    batch = np.asarray(batch, dtype=np.float32).reshape(len(batch), batch.shape[1], batch.shape[2])
+    thumbs = np.stack([cv2.resize(s, (FEATURE_GRID, FEATURE_GRID), interpolation=cv2.INTER_AREA) for s in batch])
+    flat = batch.reshape(len(batch), -1)
+    bins = np.minimum((flat * HISTOGRAM_BINS).astype(np.int64), HISTOGRAM_BINS - 1)
+    offsets = np.arange(len(batch))[:, None] * HISTOGRAM_BINS
+    histogram = np.bincount((bins + offsets).ravel(), minlength=len(batch) * HISTOGRAM_BINS)
+    histogram = histogram.reshape(len(batch), HISTOGRAM_BINS) / flat.shape[1]
+    return np.concatenate([
+        flat.mean(axis=1, keepdims=True),
+        flat.std(axis=1, keepdims=True),
+        flat.max(axis=1, keepdims=True),
+        histogram,
+        thumbs.reshape(len(batch), -1),
+    ], axis=1).astype(np.float32)
+
+
+class SliceFilter:
+    """Decides per slice whether the full model has to run.
+
+    A slice is skipped when its intensity spread is below ``min_std`` or
+    fewer than ``min_foreground`` of its pixels are brighter than
+    ``foreground_level``. If a classifier has been trained, slices it scores
+    below ``threshold`` are skipped too.
+    """
+
+    def __init__(self, min_std=0.01, foreground_level=0.1, min_foreground=0.01, classifier=None):
+        self.min_std = min_std
+        self.foreground_level = foreground_level
+        self.min_foreground = min_foreground
+        self.classifier = classifier
+
+        self.checked = 0
+        self.skipped = 0
+
+    def needs_model(self, batch):
+        batch = np.asarray(batch)
+        flat = batch[:, ::RULE_STRIDE, ::RULE_STRIDE].reshape(len(batch), -1)
+        keep = flat.std(axis=1) >= self.min_std
+        keep &= np.mean(flat > self.foreground_level, axis=1) >= self.min_foreground
+        if self.classifier is not None and keep.any():
+            keep[keep] = self.scores(batch[keep]) >= self.classifier["threshold"]
+        self.checked += len(keep)
+        self.skipped += int(np.count_nonzero(~keep))
+        return keep
+
+    def scores(self, batch):
+        c = self.classifier
+        features = (slice_features(batch) - c["mean"]) / c["scale"]
+        return 1 / (1 + np.exp(-(features @ c["weights"] + c["bias"])))
+
+    def predict(self, batch, predict_fn):
+        """Run ``predict_fn`` only on the slices that need it.
+
+        Returns ``(masks, skipped)``; skipped slices get an all-zero mask.
+        """
+        keep = self.needs_model(batch)
+        masks = np.zeros(batch.shape, dtype=np.float32)
+        if keep.all():
+            masks = predict_fn(batch)
+        elif keep.any():
+            masks[keep] = predict_fn(np.ascontiguousarray(batch[keep]))
+        return masks, ~keep
+
+    def fingerprint(self):
+        """Short hash of everything that decides which slices are skipped."""
+        digest = hashlib.sha256(np.array([self.min_std, self.foreground_level, self.min_foreground, RULE_STRIDE],
+                                         dtype=np.float64).tobytes())
+        for key in sorted(self.classifier or {}):
+            digest.update(key.encode("utf-8"))
+            digest.update(np.asarray(self.classifier[key], dtype=np.float64).tobytes())
+        return digest.hexdigest()[:12]
+
+    def stats(self):
+        return {
+            "checked": self.checked,
+            "skipped": self.skipped,
+            "skip_rate": self.skipped / self.checked if self.checked else 0.0,
+            "classifier": self.classifier is not None,
+        }
+
+    def save(self, path):
+        c = self.classifier or {}
+        np.savez(path, rules=np.array([self.min_std, self.foreground_level, self.min_foreground]),
+                 **{key: np.asarray(value) for key, value in c.items()})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            classifier = None
+            if "weights" in data.files:
+                classifier = {key: data[key] for key in ("mean", "scale", "weights", "bias", "threshold")}
+                classifier["threshold"] = float(classifier["threshold"])
+                classifier["bias"] = float(classifier["bias"])
+            min_std, foreground_level, min_foreground = data["rules"].tolist()
+        return cls(min_std, foreground_level, min_foreground, classifier)
+
+
+def _cache_features(cache, indices, chunk_size=1024):
+    features = []
+    for start in range(0, len(indices), chunk_size):
+        images, _ = cache.read(indices[start:start + chunk_size])
+        features.append(slice_features(images.astype(np.float32) / 255))
+    return np.concatenate(features) if features else np.zeros((0, 0), dtype=np.float32)
+
+
+def train_slice_filter(cache, volumes=None, target_recall=0.995, iterations=500, learning_rate=0.5, l2=1e-3):
+    """Fit the classifier on a slice cache to find slices that contain liver.
+
+    Liver slices are the positives, since every tumor lies in the liver. The
+    threshold is set so that ``target_recall`` of the training liver slices
+    still reach the model.
+    """
+    indices = cache.select(volumes, skip_empty_images=False)
+    labels = (cache.stats["mask_max"][indices] > 0).astype(np.float32)
+    if labels.min() == labels.max():
+        raise ValueError("Training slices need both liver and non-liver examples")
+
+    features = _cache_features(cache, indices)
+    mean = features.mean(axis=0)
+    scale = features.std(axis=0) + 1e-6
+    x = (features - mean) / scale
+
+    # Balanced classes, plain batch gradient descent
+    weights_per_sample = np.where(labels == 1, 0.5 / labels.mean(), 0.5 / (1 - labels.mean()))
+    weights = np.zeros(x.shape[1], dtype=np.float64)
+    bias = 0.0
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(-(x @ weights + bias)))
+        error = (p - labels) * weights_per_sample / len(labels)
+        weights -= learning_rate * (x.T @ error + l2 * weights)
+        bias -= learning_rate * error.sum()
+
+    scores = 1 / (1 + np.exp(-(x @ weights + bias)))
+    threshold = float(np.quantile(scores[labels == 1], 1 - target_recall))
+    return SliceFilter(classifier={"mean": mean, "scale": scale, "weights": weights, "bias": float(bias),
+                                   "threshold": threshold})
+
+
+def evaluate_slice_filter(slice_filter, cache, volumes=None, predict_fn=None, batch_size=8):
+    """Skip rate and missed liver/tumor slices on a slice cache, plus the inference time saved.
+
+    ``mask_max`` in the cache stats is the raw label, so 1 is liver and 2 is
+    tumor (LiTS labels). With ``predict_fn`` the model's per-slice time is
+    measured to estimate the saving.
+    """
+    indices = cache.select(volumes, skip_empty_images=False)
+    keep = np.zeros(len(indices), dtype=bool)
+    filter_seconds = 0.0
+    for start in range(0, len(indices), 1024):
+        images, _ = cache.read(indices[start:start + 1024])
+        images = images.astype(np.float32) / 255
+        started = time.perf_counter()
+        keep[start:start + len(images)] = slice_filter.needs_model(images)
+        filter_seconds += time.perf_counter() - started
+
+    mask_max = cache.stats["mask_max"][indices]
+    liver = mask_max > 0
+    tumor = mask_max >= 2
+    report = {
+        "slices": len(indices),
+        "skipped": int(np.count_nonzero(~keep)),
+        "skip_rate": float(np.mean(~keep)) if len(indices) else 0.0,
+        "liver_slices": int(np.count_nonzero(liver)),
+        "liver_slices_missed": int(np.count_nonzero(liver & ~keep)),
+        "liver_recall": float(np.mean(keep[liver])) if liver.any() else None,
+        "tumor_slices": int(np.count_nonzero(tumor)),
+        "tumor_slices_missed": int(np.count_nonzero(tumor & ~keep)),
+        "tumor_recall": float(np.mean(keep[tumor])) if tumor.any() else None,
+        "filter_ms_per_slice": filter_seconds / max(len(indices), 1) * 1000,
+    }
+
+    if predict_fn is not None and len(indices):
+        images, _ = cache.read(indices[:batch_size])
+        batch = (images.astype(np.float32) / 255)[..., np.newaxis]
+        predict_fn(batch)
+        started = time.perf_counter()
+        predict_fn(batch)
+        per_slice = (time.perf_counter() - started) / len(batch)
+        full = per_slice * len(indices)
+        filtered = per_slice * int(np.count_nonzero(keep)) + filter_seconds
+        report.update(model_ms_per_slice=per_slice * 1000, inference_seconds_without_filter=full,
+                      inference_seconds_with_filter=filtered, inference_time_saved=1 - filtered / full)
+    return report
+
+
+def main(argv=None):
+    from data_pipeline import SliceCache
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train = commands.add_parser("train", help="Train the classifier on a slice cache")
+    train.add_argument("cache_dir")
+    train.add_argument("output")
+    train.add_argument("--recall", type=float, default=0.995, help="Fraction of liver slices to keep")
+
+    evaluate = commands.add_parser("evaluate", help="Report skip rate and missed slices on a slice cache")
+    evaluate.add_argument("cache_dir")
+    evaluate.add_argument("filter", nargs="?", help="Trained filter (.npz); intensity rules only if omitted")
+    evaluate.add_argument("--model", help="Keras model, to estimate the inference time saved")
+
+    args = parser.parse_args(argv)
+    cache = SliceCache(args.cache_dir)
+
+    if args.command == "train":
+        train_volumes, val_volumes = cache.split_volumes()
+        slice_filter = train_slice_filter(cache, train_volumes, target_recall=args.recall)
+        slice_filter.save(args.output)
+        print(json.dumps(evaluate_slice_filter(slice_filter, cache, val_volumes), indent=2))
+    else:
+        slice_filter = SliceFilter.load(args.filter) if args.filter else SliceFilter()
+        predict_fn = None
+        if args.model:
+            import tensorflow as tf
+
+            predict_fn = tf.keras.models.load_model(args.model).predict_on_batch
+        print(json.dumps(evaluate_slice_filter(slice_filter, cache, predict_fn=predict_fn), indent=2))
+
+
+if __name__ == "__main__":
+    main()
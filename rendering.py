@@ -0,0 +1,365 @@
+import io
+import math
+
+import cv2
+import numpy as np
+
+MATPLOTLIB = "matplotlib"
+OPENCV = "opencv"
+BACKENDS = (MATPLOTLIB, OPENCV)
+
+DPI = 100
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+BLACK = (0, 0, 0)
+WHITE = (255, 255, 255)
+
+# The Hershey fonts only cover ASCII, so superscripts (as in "cm³") are
+# drawn as smaller digits raised to the top of the line
+SUPERSCRIPTS = {"²": "2", "³": "3"}
+SUPERSCRIPT_SCALE = 0.6
+
+# RGB values of the matplotlib colour names used by the charts
+COLORS = {
+    "lightblue": (173, 216, 230),
+    "lightgreen": (144, 238, 144),
+    "lightcoral": (240, 128, 128),
+    "pink": (255, 192, 203),
+    "red": (255, 0, 0),
+    "green": (0, 128, 0),
+    "yellow": (255, 255, 0),
+    "orange": (255, 165, 0),
+}
+
+
+def render_triptych(original_img, mask, blended, backend=MATPLOTLIB):
+    """Render the original / mask / overlay panels as PNG bytes."""
+    if backend == OPENCV:
+        return _cv2_triptych(original_img, mask, blended)
+    if backend == MATPLOTLIB:
+        return _mpl_triptych(original_img, mask, blended)
+    raise ValueError(f"Unknown render backend: {backend}")
+
+
+def render_chart(spec, backend=MATPLOTLIB):
+    """Render a chart spec (see ``create_relationship_diagrams``) as PNG bytes."""
+    if backend == OPENCV:
+        renderer = {"pie": _cv2_pie, "bar": _cv2_bar, "barh": _cv2_barh}[spec["kind"]]
+        return renderer(spec)
+    if backend == MATPLOTLIB:
+        return _mpl_chart(spec)
+    raise ValueError(f"Unknown render backend: {backend}")
+
+
+# Matplotlib backend
+#
+# Uses the object-oriented Figure API rather than pyplot, so no global figure
+# state is shared between request threads.
+
+def _mpl_png(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def _mpl_triptych(original_img, mask, blended):
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(18, 6))
+    ax1, ax2, ax3 = fig.subplots(1, 3)
+
+    ax1.imshow(original_img)
+    ax1.set_title('Original Image')
+    ax1.axis('off')
+
+    ax2.imshow(mask, cmap='gray')
+    ax2.set_title('Segmentation Mask')
+    ax2.axis('off')
+
+    ax3.imshow(blended)
+    ax3.set_title('Tumor Detection')
+    ax3.axis('off')
+
+    return _mpl_png(fig)
+
+
+def _mpl_chart(spec):
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=spec["figsize"])
+    ax = fig.subplots()
+    kind = spec["kind"]
+    if kind == "pie":
+        ax.pie(spec["values"], labels=spec["labels"], autopct='%1.1f%%', colors=spec["colors"])
+    elif kind == "bar":
+        ax.bar(spec["labels"], spec["values"], color=spec["colors"])
+        if spec.get("ylim"):
+            ax.set_ylim(*spec["ylim"])
+    elif kind == "barh":
+        y_pos = np.arange(len(spec["labels"]))
+        ax.barh(y_pos, spec["values"], align='center', color=spec["colors"])
+        ax.set_yticks(y_pos)
+        ax.set_yticklabels(spec["labels"])
+        if spec.get("invert"):
+            ax.invert_yaxis()
+    else:
+        raise ValueError(f"Unknown chart kind: {kind}")
+
+    ax.set_title(spec["title"])
+    if spec.get("xlabel"):
+        ax.set_xlabel(spec["xlabel"])
+    if spec.get("ylabel"):
+        ax.set_ylabel(spec["ylabel"])
+    return _mpl_png(fig)
+
+
+# OpenCV backend
+#
+# Draws straight into an RGB uint8 canvas with the same figure sizes, titles,
+# colours and layout as the matplotlib charts, then encodes it to PNG.
+
+def _canvas(figsize):
+    return np.full((int(figsize[1] * DPI), int(figsize[0] * DPI), 3), 255, dtype=np.uint8)
+
+
+def _encode_png(canvas):
+    ok, encoded = cv2.imencode('.png', cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR))
+    if not ok:
+        raise RuntimeError("PNG encoding failed")
+    return encoded.tobytes()
+
+
+def _color(name):
+    if name.startswith("#"):
+        return tuple(int(name[i:i + 2], 16) for i in (1, 3, 5))
+    return COLORS[name]
+
+
+def _colors(spec, n):
+    colors = spec["colors"]
+    if isinstance(colors, str):
+        colors = [colors]
+    return [_color(colors[i % len(colors)]) for i in range(n)]
+
+
+def _text_runs(text):
+    """Split ``text`` into [run, is_superscript] pairs with the superscripts as ASCII."""
+    runs = []
+    for char in text:
+        superscript = char in SUPERSCRIPTS
+        char = SUPERSCRIPTS.get(char, char)
+        if runs and runs[-1][1] == superscript:
+            runs[-1][0] += char
+        else:
+            runs.append([char, superscript])
+    return runs
+
+
+def _text_size(text, scale, thickness=1):
+    (_, h), baseline = cv2.getTextSize(text.translate(str.maketrans(SUPERSCRIPTS)), FONT, scale, thickness)
+    w = sum(cv2.getTextSize(run, FONT, scale * SUPERSCRIPT_SCALE if superscript else scale, thickness)[0][0]
+            for run, superscript in _text_runs(text))
+    return (w, h), baseline
+
+
+def _put_text(canvas, text, org, scale, color=BLACK, thickness=1):
+    x, y = org
+    digit_h = cv2.getTextSize("0", FONT, scale, thickness)[0][1]
+    for run, superscript in _text_runs(text):
+        run_scale = scale * SUPERSCRIPT_SCALE if superscript else scale
+        (w, h), _ = cv2.getTextSize(run, FONT, run_scale, thickness)
+        lift = digit_h - h if superscript else 0
+        cv2.putText(canvas, run, (int(round(x)), int(round(y - lift))), FONT, run_scale, color, thickness,
+                    cv2.LINE_AA)
+        x += w
+
+
+def _text(canvas, text, x, y, scale=0.45, color=BLACK, thickness=1, align="center", valign="center"):
+    (w, h), _ = _text_size(text, scale, thickness)
+    if align == "center":
+        x -= w / 2
+    elif align == "right":
+        x -= w
+    if valign == "center":
+        y += h / 2
+    elif valign == "top":
+        y += h
+    _put_text(canvas, text, (x, y), scale, color, thickness)
+
+
+def _vertical_text(canvas, text, x, y_center, scale=0.45):
+    (w, h), baseline = _text_size(text, scale)
+    patch = np.full((h + baseline + 4, w + 4, 3), 255, dtype=np.uint8)
+    _put_text(patch, text, (2, h + 2), scale)
+    patch = cv2.rotate(patch, cv2.ROTATE_90_COUNTERCLOCKWISE)
+
+    ph, pw = patch.shape[:2]
+    top = max(0, int(y_center - ph / 2))
+    patch = patch[:canvas.shape[0] - top, :canvas.shape[1] - x]
+    region = canvas[top:top + patch.shape[0], x:x + patch.shape[1]]
+    np.minimum(region, patch, out=region)
+
+
+def _title(canvas, title):
+    _text(canvas, title, canvas.shape[1] / 2, 22, scale=0.6)
+
+
+def _nice_ticks(upper):
+    """Ticks from 0 to ``upper`` and the decimals their labels need (0.25 steps need two)."""
+    raw = upper / 5 if upper > 0 else 0.2
+    power = math.floor(math.log10(raw))
+    mantissa = next(s for s in (1, 2, 2.5, 5, 10) if s * 10 ** power >= raw)
+    step = mantissa * 10 ** power
+    decimals = max(0, -power - (mantissa == 10) + (mantissa == 2.5))
+    return np.arange(0, upper + step * 1e-6, step), decimals
+
+
+def _fit(img, max_w, max_h, interpolation):
+    h, w = img.shape[:2]
+    scale = min(max_w / w, max_h / h)
+    size = (max(1, int(w * scale)), max(1, int(h * scale)))
+    return cv2.resize(img, size, interpolation=interpolation)
+
+
+def _to_rgb(img):
+    if img.ndim == 2:
+        return np.stack((img,) * 3, axis=-1)
+    return img[:, :, :3]
+
+
+def _cv2_triptych(original_img, mask, blended):
+    canvas = _canvas((18, 6))
+    height, width = canvas.shape[:2]
+    panel_w = width // 3
+    top, bottom = 70, 40
+
+    panels = [
+        ("Original Image", _to_rgb(original_img)),
+        ("Segmentation Mask", _to_rgb((mask > 0).astype(np.uint8) * 255)),
+        ("Tumor Detection", _to_rgb(blended)),
+    ]
+    for i, (title, img) in enumerate(panels):
+        img = _fit(img.astype(np.uint8), panel_w - 40, height - top - bottom, cv2.INTER_NEAREST)
+        h, w = img.shape[:2]
+        x0 = i * panel_w + (panel_w - w) // 2
+        y0 = top + (height - top - bottom - h) // 2
+        canvas[y0:y0 + h, x0:x0 + w] = img
+        _text(canvas, title, x0 + w / 2, y0 - 14, scale=0.7, valign="bottom")
+
+    return _encode_png(canvas)
+
+
+def _cv2_pie(spec):
+    canvas = _canvas(spec["figsize"])
+    height, width = canvas.shape[:2]
+    _title(canvas, spec["title"])
+
+    values = [float(v) for v in spec["values"]]
+    total = sum(values)
+    center = (width // 2, height // 2 + 15)
+    radius = int(min(width, height) * 0.33)
+
+    # Wedges start at 3 o'clock and run counterclockwise, as in matplotlib.
+    # OpenCV angles run clockwise because the y axis points down.
+    start = 0.0
+    for value, label, color in zip(values, spec["labels"], _colors(spec, len(values))):
+        sweep = 360.0 * value / total if total else 0.0
+        if sweep > 0:
+            cv2.ellipse(canvas, center, (radius, radius), 0, -(start + sweep), -start, color, -1, cv2.LINE_AA)
+
+        mid = math.radians(start + sweep / 2)
+        cos, sin = math.cos(mid), math.sin(mid)
+        _text(canvas, label, center[0] + 1.1 * radius * cos, center[1] - 1.1 * radius * sin,
+              align="left" if cos >= 0 else "right")
+        percent = 100.0 * value / total if total else 0.0
+        _text(canvas, f"{percent:.1f}%", center[0] + 0.6 * radius * cos, center[1] - 0.6 * radius * sin)
+        start += sweep
+
+    return _encode_png(canvas)
+
+
+def _cv2_axes(canvas, left, top, right, bottom):
+    height, width = canvas.shape[:2]
+    x0, y0, x1, y1 = left, top, width - right, height - bottom
+    cv2.rectangle(canvas, (x0, y0), (x1, y1), BLACK, 1)
+    return x0, y0, x1, y1
+
+
+def _cv2_bar(spec):
+    canvas = _canvas(spec["figsize"])
+    _title(canvas, spec["title"])
+    x0, y0, x1, y1 = _cv2_axes(canvas, 80, 40, 20, 40)
+
+    values = [float(v) for v in spec["values"]]
+    ylim = spec.get("ylim") or (0, max(max(values), 1e-9) * 1.05)
+    ticks, decimals = _nice_ticks(ylim[1])
+
+    def y_of(v):
+        return int(round(y1 - (v - ylim[0]) / (ylim[1] - ylim[0]) * (y1 - y0)))
+
+    for tick in ticks:
+        if tick > ylim[1]:
+            continue
+        y = y_of(tick)
+        cv2.line(canvas, (x0 - 4, y), (x0, y), BLACK, 1)
+        _text(canvas, f"{tick:.{decimals}f}", x0 - 7, y, scale=0.4, align="right")
+
+    slot = (x1 - x0) / len(values)
+    for i, (value, label, color) in enumerate(zip(values, spec["labels"], _colors(spec, len(values)))):
+        cx = x0 + slot * (i + 0.5)
+        half = slot * 0.4
+        if value > ylim[0]:
+            cv2.rectangle(canvas, (int(cx - half), y_of(min(value, ylim[1]))), (int(cx + half), y1 - 1), color, -1)
+        cv2.line(canvas, (int(cx), y1), (int(cx), y1 + 4), BLACK, 1)
+        _text(canvas, label, cx, y1 + 8, scale=0.4, valign="top")
+
+    if spec.get("ylabel"):
+        _vertical_text(canvas, spec["ylabel"], 8, (y0 + y1) / 2)
+    return _encode_png(canvas)
+
+
+def _cv2_barh(spec):
+    canvas = _canvas(spec["figsize"])
+    _title(canvas, spec["title"])
+    x0, y0, x1, y1 = _cv2_axes(canvas, 130, 40, 25, 60)
+
+    values = [float(v) for v in spec["values"]]
+    xmax = max(max(values), 1e-9) * 1.05
+
+    def x_of(v):
+        return int(round(x0 + v / xmax * (x1 - x0)))
+
+    ticks, decimals = _nice_ticks(xmax)
+    for tick in ticks:
+        if tick > xmax:
+            continue
+        x = x_of(tick)
+        cv2.line(canvas, (x, y1), (x, y1 + 4), BLACK, 1)
+        _text(canvas, f"{tick:.{decimals}f}", x, y1 + 8, scale=0.4, valign="top")
+
+    n = len(values)
+    slot = (y1 - y0) / n
+    for i, (value, label, color) in enumerate(zip(values, spec["labels"], _colors(spec, n))):
+        row = i if spec.get("invert") else n - 1 - i
+        cy = y0 + slot * (row + 0.5)
+        half = slot * 0.4
+        cv2.rectangle(canvas, (x0 + 1, int(cy - half)), (x_of(value), int(cy + half)), color, -1)
+        cv2.line(canvas, (x0 - 4, int(cy)), (x0, int(cy)), BLACK, 1)
+
+        # Multi-line tick labels; a "↓" line is drawn as an arrow since the
+        # Hershey fonts have no glyph for it
+        lines = label.split("\n")
+        line_h = 16
+        first = cy - line_h * (len(lines) - 1) / 2
+        label_w = max(_text_size(line, 0.4)[0][0] for line in lines)
+        label_x = x0 - 8 - label_w / 2
+        for j, line in enumerate(lines):
+            y = first + j * line_h
+            if line == "↓":
+                cv2.arrowedLine(canvas, (int(label_x), int(y - 6)), (int(label_x), int(y + 6)), BLACK, 1,
+                                cv2.LINE_AA, tipLength=0.4)
+            else:
+                _text(canvas, line, label_x, y, scale=0.4)
+
+    if spec.get("xlabel"):
+        _text(canvas, spec["xlabel"], (x0 + x1) / 2, y1 + 40, scale=0.45)
+    return _encode_png(canvas)
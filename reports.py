@@ -0,0 +1,263 @@
+import io
+
+ADDITIONAL_RECOMMENDATIONS = [
+    "Avoid alcohol completely",
+    "Maintain healthy weight",
+    "Get vaccinated against hepatitis A and B if not already immune",
+    "Monitor liver function regularly",
+    "Follow a liver-friendly diet (low fat, moderate protein)",
+    "Stay hydrated",
+    "Avoid unnecessary medications that can stress the liver",
+]
+
+# Fixed page layout shared by every report; only the content changes
+FONT = "Arial"
+TITLE = "Liver Tumor Detection Report"
+TITLE_STYLE = (FONT, 'B', 16)
+SECTION_STYLE = (FONT, 'B', 12)
+HEADING_STYLE = (FONT, 'B', 11)
+TABLE_HEADER_STYLE = (FONT, 'B', 10)
+BODY_STYLE = (FONT, '', 10)
+LINE_HEIGHT = 7
+LABEL_WIDTH = 60
+INDENT = 10
+LESION_COLUMNS = ("Lesion", "Volume (mm³)", "Max Diameter (mm)", "Centre (x, y)")
+LESION_WIDTHS = (25, 45, 50, 50)
+
+
+def build_report(disease_info, name, national_id, nationality, age, mobile_number, gender,
+                 chronic_diseases, liver_enzymes, bilirubin, albumin, weight, height):
+    try:
+        bmi = float(weight) / ((float(height)/100) ** 2)
+    except ValueError:
+        bmi = 0
+    
+    try:
+        clean_liver_enzymes = float(''.join(c for c in str(liver_enzymes) if c.isdigit() or c == '.'))
+    except ValueError:
+        clean_liver_enzymes = 0
+    
+    patient = [
+        ["Name", name],
+        ["National ID", national_id],
+        ["Nationality", nationality],
+        ["Age", age],
+        ["Mobile Number", mobile_number],
+        ["Gender", gender],
+        ["Chronic Diseases", chronic_diseases],
+        ["Liver Enzymes (ALT)", f"{clean_liver_enzymes} IU/L"],
+        ["Bilirubin", f"{bilirubin} mg/dL"],
+        ["Albumin", f"{albumin} g/dL"],
+        ["Weight", f"{weight} kg"],
+        ["Height", f"{height} cm"],
+        ["BMI", f"{bmi:.1f}"],
+    ]
+    tumor = [
+        ["Tumor Volume", f"{disease_info['volume']:.2f} mm³ (~{disease_info['volume']/1000:.1f} cm³)"],
+        ["Tumor Size Category", disease_info['volume_category']],
+    ]
+    if disease_info.get('skipped'):
+        tumor.append(["Segmentation", "Skipped (blank scan or no liver)"])
+    lesions = disease_info.get('lesions', [])
+    if lesions:
+        tumor += [
+            ["Lesion Count", str(len(lesions))],
+            ["Largest Lesion Diameter", f"{max(lesion['max_diameter'] for lesion in lesions):.1f} mm"],
+        ]
+    if disease_info.get('model_version'):
+        tumor.append(["Model Version", disease_info['model_version']])
+    
+    if "No Tumor" in disease_info['type']:
+        summary = (f"{name} shows no signs of liver tumors in the scan. No further treatment is required. "
+                   "However, if the patient has risk factors like hepatitis or alcohol use, "
+                   "regular monitoring is recommended.")
+        recommendations = []
+    else:
+        summary = (f"{name} has a liver condition that requires medical attention. "
+                   "Consultation with a hepatologist or oncologist is strongly recommended. "
+                   "Depending on the diagnosis, further tests like biopsy or additional imaging "
+                   "may be needed to confirm the diagnosis and plan treatment.")
+        recommendations = list(ADDITIONAL_RECOMMENDATIONS)
+    
+    risk_factors = []
+    
+    if int(age) > 60:
+        risk_factors.append(["Age", "Patients over 60 years old are at higher risk of liver cancer."])
+    else:
+        risk_factors.append(["Age", "Younger patients have a lower risk of liver cancer."])
+    
+    if gender == "Male":
+        risk_factors.append(["Gender", "Males have higher risk of liver cancer compared to females."])
+    else:
+        risk_factors.append(["Gender", "Females have lower risk of liver cancer compared to males."])
+    
+    if chronic_diseases.lower() in ["hepatitis", "cirrhosis", "fatty liver"]:
+        risk_factors.append(["Chronic Diseases", "Patients with chronic liver diseases are at higher risk of complications."])
+    else:
+        risk_factors.append(["Chronic Diseases", "No significant chronic liver diseases were reported."])
+    
+    if clean_liver_enzymes > 40:
+        risk_factors.append(["Liver Enzymes", "Elevated liver enzymes may indicate liver damage or inflammation."])
+    else:
+        risk_factors.append(["Liver Enzymes", "Normal liver enzyme levels."])
+    
+    vol_cm3 = disease_info['volume'] / 1000
+    if vol_cm3 < 1:
+        risk_factors.append(["Tumor Volume", "Very small tumor (<1 cm³), lower risk."])
+    elif 1 <= vol_cm3 < 5:
+        risk_factors.append(["Tumor Volume", "Small tumor (1-5 cm³), moderate risk."])
+    elif 5 <= vol_cm3 < 10:
+        risk_factors.append(["Tumor Volume", "Medium tumor (5-10 cm³), high risk."])
+    else:
+        risk_factors.append(["Tumor Volume", "Large tumor (>10 cm³), very high risk."])
+    
+    if bmi > 30:
+        risk_factors.append(["BMI", "Obesity is a risk factor for fatty liver disease and liver cancer."])
+    elif bmi > 25:
+        risk_factors.append(["BMI", "Overweight status may contribute to liver disease risk."])
+    else:
+        risk_factors.append(["BMI", "Healthy weight reduces liver disease risk."])
+    
+    report = {
+        "patient": patient,
+        "tumor": tumor,
+        "lesions": [lesion_row(lesion) for lesion in lesions],
+        "disease_info": disease_info,
+        "summary": summary,
+        "recommendations": recommendations,
+        "risk_factors": risk_factors,
+    }
+    report["text"] = report_text(report)
+    return report
+
+
+def lesion_row(lesion):
+    x, y = lesion['centroid'][:2]
+    return [str(lesion['id']), f"{lesion['volume']:.1f}", f"{lesion['max_diameter']:.1f}", f"({x:.0f}, {y:.0f})"]
+
+
+def report_text(report):
+    disease_info = report["disease_info"]
+    
+    text = "".join(f"{label}: {value}\n" for label, value in report["patient"] + report["tumor"]) + "\n"
+    
+    if report.get("lesions"):
+        text += "Lesions (volume mm³, max diameter mm, centre):\n"
+        text += "".join(f"- Lesion {lesion_id}: {volume}, {diameter}, {centre}\n"
+                        for lesion_id, volume, diameter, centre in report["lesions"]) + "\n"
+    
+    text += f"Diagnosis: {disease_info['type']}\n\n"
+    text += f"Description: {disease_info['description']}\n\n"
+    text += f"Potential Causes:\n{disease_info['causes']}\n\n"
+    text += f"Recommended Treatment:\n{disease_info['treatment']}\n\n"
+    text += f"Prevention Strategies:\n{disease_info['prevention']}\n\n"
+    text += f"{report['summary']}\n\n"
+    
+    if report["recommendations"]:
+        text += "Additional Recommendations:\n"
+        text += "".join(f"- {item}\n" for item in report["recommendations"]) + "\n"
+    
+    text += "\nRelationships between Input Data and Diagnosis:\n"
+    text += "".join(f"- {label}: {description}\n" for label, description in report["risk_factors"])
+    return text
+
+
+def _section(pdf, title):
+    pdf.set_font(*SECTION_STYLE)
+    pdf.cell(0, 10, title, new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font(*BODY_STYLE)
+
+
+def _paragraph(pdf, text, indent=0):
+    pdf.set_x(pdf.l_margin + indent)
+    pdf.multi_cell(0, LINE_HEIGHT, text, new_x="LMARGIN", new_y="NEXT")
+
+
+def _heading(pdf, heading, text):
+    pdf.set_font(*HEADING_STYLE)
+    pdf.cell(0, LINE_HEIGHT, heading, new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font(*BODY_STYLE)
+    _paragraph(pdf, text)
+
+
+def render_report_pdf(report, overlay_png):
+    """Lay out a structured report as a PDF and return its bytes."""
+    from fpdf import FPDF
+    
+    disease_info = report["disease_info"]
+    
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    
+    # Title page
+    pdf.add_page()
+    pdf.set_font(*TITLE_STYLE)
+    pdf.cell(0, 10, TITLE, align='C', new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(20)
+    
+    # Patient information table
+    _section(pdf, "Patient Information:")
+    pdf.ln(5)
+    pdf.set_font(*TABLE_HEADER_STYLE)
+    pdf.cell(LABEL_WIDTH, LINE_HEIGHT, "Field", border=1)
+    pdf.cell(0, LINE_HEIGHT, "Value", border=1, new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font(*BODY_STYLE)
+    for field, value in report["patient"]:
+        pdf.cell(LABEL_WIDTH, LINE_HEIGHT, field, border=1)
+        pdf.cell(0, LINE_HEIGHT, str(value), border=1, new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(10)
+    
+    # Diagnosis
+    _section(pdf, "Diagnosis:")
+    _heading(pdf, "Diagnosis:", disease_info['type'])
+    _heading(pdf, "Description:", disease_info['description'])
+    _heading(pdf, "Recommended Treatment:", disease_info['treatment'])
+    _paragraph(pdf, report["summary"])
+    if report["recommendations"]:
+        pdf.set_font(*HEADING_STYLE)
+        pdf.cell(0, LINE_HEIGHT, "Additional Recommendations:", new_x="LMARGIN", new_y="NEXT")
+        pdf.set_font(*BODY_STYLE)
+        for item in report["recommendations"]:
+            _paragraph(pdf, f"- {item}", indent=INDENT)
+    pdf.ln(5)
+    
+    # Tumor volume
+    _section(pdf, "Tumor Volume Analysis:")
+    for label, value in report["tumor"]:
+        pdf.cell(0, LINE_HEIGHT, f"{label}: {value}", new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(5)
+    
+    if report.get("lesions"):
+        _section(pdf, "Lesions:")
+        pdf.set_font(*TABLE_HEADER_STYLE)
+        for header, width in zip(LESION_COLUMNS, LESION_WIDTHS):
+            pdf.cell(width, LINE_HEIGHT, header, border=1)
+        pdf.ln(LINE_HEIGHT)
+        pdf.set_font(*BODY_STYLE)
+        for row in report["lesions"]:
+            for value, width in zip(row, LESION_WIDTHS):
+                pdf.cell(width, LINE_HEIGHT, value, border=1)
+            pdf.ln(LINE_HEIGHT)
+        pdf.ln(5)
+    
+    # Causes and prevention
+    _section(pdf, "Potential Causes:")
+    _paragraph(pdf, disease_info['causes'])
+    pdf.ln(5)
+    
+    _section(pdf, "Prevention Strategies:")
+    _paragraph(pdf, disease_info['prevention'])
+    pdf.ln(5)
+    
+    # Risk factors
+    _section(pdf, "Risk Factors Analysis:")
+    for label, description in report["risk_factors"]:
+        _paragraph(pdf, f"{label}: {description}", indent=INDENT)
+    pdf.ln(5)
+    
+    # Visualization page
+    pdf.add_page()
+    _section(pdf, "Liver Scan Analysis:")
+    pdf.image(io.BytesIO(overlay_png), x=10, y=None, w=180)
+    
+    return bytes(pdf.output())
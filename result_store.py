@@ -0,0 +1,208 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from mask_codec import decode_mask, encode_mask
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id TEXT PRIMARY KEY,
+    national_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    model_version TEXT,
+    disease_type TEXT,
+    volume REAL,
+    lesion_count INTEGER,
+    patient TEXT,
+    disease_info TEXT,
+    mask BLOB,
+    mask_shape TEXT
+);
+CREATE INDEX IF NOT EXISTS analyses_patient_time ON analyses (national_id, created_at);
+"""
+
+SUMMARY_COLUMNS = "id, national_id, created_at, model_version, disease_type, volume, lesion_count"
+
+
+class ResultStore:
+    """Finished analyses persisted in SQLite, indexed by patient and time.
+
+    ``save`` only queues the record; a background thread writes queued
+    records in batches of up to ``batch_size``, one transaction each, at
+    least every ``flush_interval`` seconds. If more than ``max_queue``
+    records are waiting, new ones are dropped (and counted) rather than
+    slowing down analyses.
+    """
+
+    def __init__(self, path, batch_size=64, flush_interval=0.5, max_queue=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            # WAL lets history reads run while the writer commits
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._local = threading.local()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def save(self, analysis_id, patient, disease_info, mask, model_version=None, created_at=None):
+        # Encoding is cheap (well under a millisecond for a 256x256 mask), the write is not
+        encoded, shape = encode_mask(mask)
+        record = (
+            analysis_id,
+            str(patient["national_id"]),
+            created_at if created_at is not None else time.time(),
+            model_version,
+            disease_info["type"],
+            float(disease_info["volume"]),
+            disease_info.get("lesion_count"),
+            json.dumps(patient),
+            json.dumps(disease_info),
+            encoded,
+            json.dumps(list(shape)),
+        )
+        self._start_writer()
+        try:
+            self._queue.put_nowait(record)
+            self.queued += 1
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self):
+        """Block until every queued record has been written."""
+        self._queue.join()
+
+    def history(self, national_id, limit=50, before=None):
+        """A patient's analyses, newest first, without masks."""
+        query = f"SELECT {SUMMARY_COLUMNS} FROM analyses WHERE national_id = ?"
+        params = [str(national_id)]
+        if before is not None:
+            query += " AND created_at < ?"
+            params.append(before)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self._reader().execute(query, params)]
+
+    def get(self, analysis_id, include_mask=False):
+        row = self._reader().execute("SELECT * FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        record["patient"] = json.loads(record["patient"])
+        record["disease_info"] = json.loads(record["disease_info"])
+        shape = tuple(json.loads(record.pop("mask_shape")))
+        encoded = record.pop("mask")
+        if include_mask:
+            record["mask"] = decode_mask(encoded, shape)
+        return record
+
+    def volume_trend(self, national_id):
+        """Tumor volume across a patient's visits, oldest first, with the change between visits."""
+        rows = self._reader().execute(
+            "SELECT id, created_at, volume, lesion_count, disease_type FROM analyses "
+            "WHERE national_id = ? ORDER BY created_at", (str(national_id),)).fetchall()
+        visits = []
+        previous = None
+        for row in rows:
+            visit = dict(row)
+            if previous is None:
+                visit.update(change=None, percent_change=None, days_since_previous=None)
+            else:
+                change = visit["volume"] - previous["volume"]
+                visit.update(
+                    change=change,
+                    percent_change=change / previous["volume"] * 100 if previous["volume"] else None,
+                    days_since_previous=(visit["created_at"] - previous["created_at"]) / 86400,
+                )
+            visits.append(visit)
+            previous = visit
+
+        summary = {"visits": len(visits)}
+        if len(visits) > 1:
+            first, last = visits[0], visits[-1]
+            days = (last["created_at"] - first["created_at"]) / 86400
+            summary.update(
+                first_volume=first["volume"],
+                last_volume=last["volume"],
+                total_change=last["volume"] - first["volume"],
+                days=days,
+                change_per_30_days=(last["volume"] - first["volume"]) / days * 30 if days else None,
+            )
+        return {"national_id": str(national_id), "summary": summary, "visits": visits}
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "pending": self._queue.qsize(),
+            "queued": self.queued,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reader(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="result-store-writer", daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                     batch)
+                self.written += len(batch)
+                self.batches += 1
+            except sqlite3.Error as e:
+                self.errors += 1
+                print(f"Error writing {len(batch)} results to {self.path}: {str(e)}")
+            for _ in batch:
+                self._queue.task_done()
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from lesions import LesionLabeler, label_lesions_2d
+
+
+def test_non_square_pixel_spacing():
+    # 40 rows by 5 columns at 1 mm rows and 3 mm columns: 40 x 15 mm in plane
+    mask = np.zeros((256, 256), dtype=np.float32)
+    mask[100:140, 100:105] = 1
+    labeler = LesionLabeler(spacing=(1.0, 3.0, 1.0))
+    for _ in range(3):
+        labeler.add_slice(mask)
+    [lesion] = labeler.lesions()
+
+    assert lesion["voxels"] == 40 * 5 * 3
+    assert lesion["volume"] == pytest.approx(40 * 5 * 3 * 3.0)
+    assert lesion["max_diameter"] == pytest.approx(np.sqrt(40 ** 2 + 15 ** 2 + 3 ** 2), rel=0.01)
+    assert lesion["bbox"] == {"x": [100, 104], "y": [100, 139], "z": [0, 2]}
+
+
+def test_non_square_pixel_spacing_2d():
+    mask = np.zeros((64, 64), dtype=np.float32)
+    mask[10:14, 20:40] = 1
+    _, [lesion] = label_lesions_2d(mask, spacing=(2.0, 0.5, 1.0))
+
+    assert lesion["area"] == pytest.approx(4 * 20 * 2.0 * 0.5)
+    assert lesion["max_diameter"] == pytest.approx(np.hypot(8, 10), rel=0.01)
+
+
+def test_empty_mask():
+    labels, lesions = label_lesions_2d(np.zeros((32, 32), dtype=np.float32))
+
+    assert lesions == []
+    assert not labels.any()
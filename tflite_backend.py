@@ -0,0 +1,205 @@
+"""Quantized TFLite inference backend for the segmentation UNet.
+
+Convert the Keras model once, then select it at runtime with
+``INFERENCE_BACKEND=tflite``::
+
+    python tflite_backend.py convert liver_tumor_segmentation_final.keras \
+        liver_tumor_segmentation_final.tflite --quantization int8 --calibration scans/
+    python tflite_backend.py compare liver_tumor_segmentation_final.keras \
+        liver_tumor_segmentation_final.tflite --samples scans/
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+QUANTIZATION_MODES = ("none", "dynamic", "float16", "int8")
+
+
+def load_sample_slices(path, limit=64, target_size=(256, 256)):
+    """Preprocessed (N, 256, 256, 1) slices from a directory of images and/or NIfTI volumes."""
+    from nifti import is_nifti_filename, iter_nifti_slices, load_nifti, preprocess_slice
+    from uploads import load_image, prepare_model_input
+
+    files = [os.path.join(path, f) for f in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+    slices = []
+    for filepath in files:
+        if len(slices) >= limit:
+            break
+        if is_nifti_filename(filepath):
+            for _, slice_img in iter_nifti_slices(load_nifti(filepath)):
+                if np.max(slice_img) == 0:
+                    continue
+                slices.append(preprocess_slice(slice_img, target_size))
+                if len(slices) >= limit:
+                    break
+        else:
+            # Decoded and resized exactly like uploads are when serving
+            try:
+                image = load_image(filepath)
+            except (OSError, ValueError):
+                continue
+            slices.append(prepare_model_input(image.gray, target_size)[0, :, :, 0])
+
+    if not slices:
+        raise ValueError(f"No usable slices found in {path}")
+    return np.stack(slices)[..., np.newaxis]
+
+
+def convert_to_tflite(keras_path, output_path, quantization="dynamic", calibration_slices=None):
+    import tensorflow as tf
+
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {quantization}")
+
+    model = tf.keras.models.load_model(keras_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if quantization == "dynamic":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if calibration_slices is None or len(calibration_slices) == 0:
+            raise ValueError("int8 quantization needs calibration slices")
+
+        def representative_dataset():
+            for slice_img in calibration_slices:
+                yield [slice_img[np.newaxis].astype(np.float32)]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        # Keep float32 input/output so callers use the same preprocessing
+        converter.inference_input_type = tf.float32
+        converter.inference_output_type = tf.float32
+
+    tflite_model = converter.convert()
+    with open(output_path, "wb") as f:
+        f.write(tflite_model)
+    return output_path
+
+
+class TFLiteModel:
+    """TFLite interpreter exposing the same ``predict_on_batch`` as a Keras model."""
+
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            # tf.lite.Interpreter is deprecated in favour of LiteRT but still ships with TensorFlow
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.model_path = model_path
+        self._interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = None
+        # The interpreter is not thread-safe
+        self._lock = threading.Lock()
+
+    def predict_on_batch(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input["index"], batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self._interpreter.set_tensor(self._input["index"], batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output["index"]).copy()
+
+    predict = predict_on_batch
+
+
+def _segmentation_scores(reference, candidate, threshold=0.5):
+    reference = reference.reshape(len(reference), -1) > threshold
+    candidate = candidate.reshape(len(candidate), -1) > threshold
+    intersection = np.count_nonzero(reference & candidate, axis=1)
+    union = np.count_nonzero(reference | candidate, axis=1)
+    total = np.count_nonzero(reference, axis=1) + np.count_nonzero(candidate, axis=1)
+    # Two empty masks agree perfectly
+    dice = np.where(total > 0, 2 * intersection / np.maximum(total, 1), 1.0)
+    iou = np.where(union > 0, intersection / np.maximum(union, 1), 1.0)
+    return dice, iou
+
+
+def _benchmark(predict_fn, slices, batch_size, runs):
+    outputs = np.concatenate([predict_fn(slices[i:i + batch_size]) for i in range(0, len(slices), batch_size)])
+    latencies = []
+    for _ in range(runs):
+        for i in range(0, len(slices), batch_size):
+            started = time.perf_counter()
+            predict_fn(slices[i:i + batch_size])
+            latencies.append(time.perf_counter() - started)
+    latencies = np.array(latencies)
+    return outputs, {
+        "batch_size": batch_size,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "slices_per_second": float(len(slices) * runs / latencies.sum()),
+    }
+
+
+def compare_backends(reference, candidate, slices, batch_size=8, runs=3):
+    """Accuracy parity (Dice/IoU of thresholded masks) and latency of two predictors."""
+    reference_out, reference_perf = _benchmark(reference.predict_on_batch, slices, batch_size, runs)
+    candidate_out, candidate_perf = _benchmark(candidate.predict_on_batch, slices, batch_size, runs)
+    dice, iou = _segmentation_scores(reference_out, candidate_out)
+    return {
+        "slices": int(len(slices)),
+        "dice_mean": float(dice.mean()),
+        "dice_min": float(dice.min()),
+        "iou_mean": float(iou.mean()),
+        "iou_min": float(iou.min()),
+        "max_abs_diff": float(np.max(np.abs(reference_out - candidate_out))),
+        "reference": reference_perf,
+        "candidate": candidate_perf,
+        "speedup": candidate_perf["slices_per_second"] / reference_perf["slices_per_second"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert = commands.add_parser("convert", help="Convert a Keras model to TFLite")
+    convert.add_argument("keras_model")
+    convert.add_argument("output")
+    convert.add_argument("--quantization", choices=QUANTIZATION_MODES, default="dynamic")
+    convert.add_argument("--calibration", help="Directory of images or NIfTI volumes for int8 calibration")
+    convert.add_argument("--calibration-size", type=int, default=100)
+
+    compare = commands.add_parser("compare", help="Compare a TFLite model against the Keras model")
+    compare.add_argument("keras_model")
+    compare.add_argument("tflite_model")
+    compare.add_argument("--samples", required=True, help="Directory of images or NIfTI volumes")
+    compare.add_argument("--sample-size", type=int, default=32)
+    compare.add_argument("--batch-size", type=int, default=8)
+    compare.add_argument("--runs", type=int, default=3)
+    compare.add_argument("--threads", type=int, default=None)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        calibration = None
+        if args.calibration:
+            calibration = load_sample_slices(args.calibration, limit=args.calibration_size)
+        convert_to_tflite(args.keras_model, args.output, args.quantization, calibration)
+        print(f"Wrote {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB)")
+    else:
+        import tensorflow as tf
+
+        slices = load_sample_slices(args.samples, limit=args.sample_size)
+        reference = tf.keras.models.load_model(args.keras_model)
+        candidate = TFLiteModel(args.tflite_model, num_threads=args.threads)
+        print(json.dumps(compare_backends(reference, candidate, slices, args.batch_size, args.runs), indent=2))
+
+
+if __name__ == "__main__":
+    main()
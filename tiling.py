@@ -0,0 +1,88 @@
+import threading
+
+import numpy as np
+
+
+def tile_starts(length, tile_size, stride):
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def blend_window(tile_size):
+    # Separable Hann window, kept strictly positive so image borders covered
+    # by a single tile still get a weight
+    hann = np.hanning(tile_size + 2)[1:-1]
+    return np.outer(hann, hann).astype(np.float32)
+
+
+class TiledPredictor:
+    """Full-resolution inference by blending overlapping model-sized tiles.
+
+    The image is cut into ``tile_size`` squares overlapping by ``overlap``
+    (a fraction of the tile), the tiles go through ``predict_fn`` in batches
+    of ``batch_size``, and the predictions are blended back with a Hann
+    window. Tile and accumulation buffers are kept per thread and reused
+    across calls, so memory stays flat for repeated large images.
+    """
+
+    def __init__(self, predict_fn, tile_size=256, overlap=0.25, batch_size=8):
+        if not 0 <= overlap < 1:
+            raise ValueError("overlap must be in [0, 1)")
+        self.predict_fn = predict_fn
+        self.tile_size = tile_size
+        self.stride = max(1, int(round(tile_size * (1 - overlap))))
+        self.batch_size = batch_size
+        self.window = blend_window(tile_size)
+        self._local = threading.local()
+
+    def _buffers(self, height, width):
+        local = self._local
+        if getattr(local, "batch", None) is None:
+            local.batch = np.empty((self.batch_size, self.tile_size, self.tile_size, 1), dtype=np.float32)
+            local.accum = np.empty((0, 0), dtype=np.float32)
+            local.weights = np.empty((0, 0), dtype=np.float32)
+        # Grow-only: a smaller image reuses a view of the existing buffers
+        if local.accum.shape[0] < height or local.accum.shape[1] < width:
+            shape = (max(height, local.accum.shape[0]), max(width, local.accum.shape[1]))
+            local.accum = np.empty(shape, dtype=np.float32)
+            local.weights = np.empty(shape, dtype=np.float32)
+        accum = local.accum[:height, :width]
+        weights = local.weights[:height, :width]
+        accum.fill(0)
+        weights.fill(0)
+        return local.batch, accum, weights
+
+    def predict(self, image, predict_fn=None):
+        """Probability map with the same (H, W) shape as ``image``.
+
+        ``predict_fn`` overrides the one given at construction for this call.
+        """
+        predict_fn = predict_fn or self.predict_fn
+        image = np.asarray(image, dtype=np.float32)
+        height, width = image.shape
+        tile = self.tile_size
+
+        # Images smaller than a tile are zero-padded, then cropped back
+        padded_h, padded_w = max(height, tile), max(width, tile)
+        if (padded_h, padded_w) != (height, width):
+            padded = np.zeros((padded_h, padded_w), dtype=np.float32)
+            padded[:height, :width] = image
+            image = padded
+
+        batch, accum, weights = self._buffers(padded_h, padded_w)
+        positions = [(y, x) for y in tile_starts(padded_h, tile, self.stride)
+                     for x in tile_starts(padded_w, tile, self.stride)]
+
+        for first in range(0, len(positions), self.batch_size):
+            chunk = positions[first:first + self.batch_size]
+            for i, (y, x) in enumerate(chunk):
+                batch[i, :, :, 0] = image[y:y + tile, x:x + tile]
+            output = predict_fn(batch[:len(chunk)])
+            for i, (y, x) in enumerate(chunk):
+                accum[y:y + tile, x:x + tile] += output[i, :, :, 0] * self.window
+                weights[y:y + tile, x:x + tile] += self.window
+
+        return (accum / weights)[:height, :width]
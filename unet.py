@@ -0,0 +1,57 @@
+from tensorflow.keras.models import Model
+from tensorflow.keras.layers import Input, Conv2D, MaxPooling2D, UpSampling2D, concatenate, Dropout, BatchNormalization
+
+IMG_WIDTH, IMG_HEIGHT = 256, 256
+INPUT_SHAPE = (IMG_WIDTH, IMG_HEIGHT, 1)
+
+
+def _conv_block(x, filters):
+    x = Conv2D(filters, (3, 3), activation='relu', kernel_initializer='he_normal', padding='same')(x)
+    x = BatchNormalization()(x)
+    x = Conv2D(filters, (3, 3), activation='relu', kernel_initializer='he_normal', padding='same')(x)
+    x = BatchNormalization()(x)
+    return x
+
+
+# Same UNet as build_unet in liver-tumor.ipynb; base_filters=32 reproduces the
+# trained model, smaller values give a cheap stand-in with the same topology
+def build_unet(input_shape=INPUT_SHAPE, base_filters=32):
+    f = base_filters
+    inputs = Input(input_shape)
+    
+    # Encoder
+    c1 = _conv_block(inputs, f)
+    p1 = MaxPooling2D((2, 2))(c1)
+    p1 = Dropout(0.1)(p1)
+    
+    c2 = _conv_block(p1, f * 2)
+    p2 = MaxPooling2D((2, 2))(c2)
+    p2 = Dropout(0.1)(p2)
+    
+    c3 = _conv_block(p2, f * 4)
+    p3 = MaxPooling2D((2, 2))(c3)
+    p3 = Dropout(0.2)(p3)
+    
+    # Bottleneck
+    c4 = _conv_block(p3, f * 8)
+    c4 = Dropout(0.2)(c4)
+    
+    # Decoder
+    u5 = UpSampling2D((2, 2))(c4)
+    u5 = concatenate([u5, c3])
+    c5 = _conv_block(u5, f * 4)
+    c5 = Dropout(0.1)(c5)
+    
+    u6 = UpSampling2D((2, 2))(c5)
+    u6 = concatenate([u6, c2])
+    c6 = _conv_block(u6, f * 2)
+    c6 = Dropout(0.1)(c6)
+    
+    u7 = UpSampling2D((2, 2))(c6)
+    u7 = concatenate([u7, c1])
+    c7 = _conv_block(u7, f)
+    
+    outputs = Conv2D(1, (1, 1), activation='sigmoid')(c7)
+    
+    model = Model(inputs=[inputs], outputs=[outputs])
+    return model
@@ -0,0 +1,114 @@
+import io
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from werkzeug.utils import secure_filename
+
+
+class DecodedImage:
+    """An upload decoded once and shared by every stage of the analysis.
+
+    ``data`` holds the raw upload bytes (used for cache keys), ``pixels`` the
+    8-bit image as (H, W) grayscale or (H, W, 3) RGB, and ``gray`` the
+    single channel the model sees, which is a view into ``pixels``.
+    """
+
+    __slots__ = ("data", "pixels", "gray")
+
+    def __init__(self, data, pixels):
+        self.data = data
+        self.pixels = pixels
+        # The model has always been fed channel 0 of colour uploads
+        self.gray = pixels if pixels.ndim == 2 else pixels[:, :, 0]
+
+    @property
+    def shape(self):
+        return self.gray.shape
+
+    def rgb(self, size=None):
+        pixels = self.pixels
+        if size is not None and (pixels.shape[1], pixels.shape[0]) != tuple(size):
+            pixels = cv2.resize(pixels, size, interpolation=cv2.INTER_LINEAR)
+        if pixels.ndim == 2:
+            return np.stack((pixels,) * 3, axis=-1)
+        return pixels
+
+
+def to_uint8(pixels):
+    if pixels.dtype == np.uint8:
+        return pixels
+    # 16-bit and float scans are stretched to the full 8-bit range, like the
+    # min-max normalisation used on CT slices in the training notebook
+    return cv2.normalize(pixels, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+
+
+def decode_image(data):
+    pixels = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if pixels is None:
+        # Formats or modes OpenCV can't read (GIF, some TIFFs, ...)
+        from PIL import Image
+
+        try:
+            image = Image.open(io.BytesIO(data))
+            if image.mode in ("P", "PA", "CMYK", "YCbCr", "LAB", "HSV"):
+                image = image.convert("RGB")
+            pixels = np.array(image)
+        except OSError:
+            raise ValueError("Could not decode the uploaded image")
+    elif pixels.ndim == 3:
+        code = cv2.COLOR_BGRA2RGB if pixels.shape[2] == 4 else cv2.COLOR_BGR2RGB
+        pixels = cv2.cvtColor(pixels, code)
+
+    if pixels.ndim == 3:
+        if pixels.shape[2] == 1:
+            pixels = pixels[:, :, 0]
+        elif pixels.shape[2] == 2:
+            # Grayscale + alpha
+            pixels = pixels[:, :, 0]
+        else:
+            pixels = pixels[:, :, :3]
+    return DecodedImage(data, to_uint8(np.ascontiguousarray(pixels)))
+
+
+def load_image(source):
+    if isinstance(source, DecodedImage):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_image(bytes(source))
+    with open(source, "rb") as f:
+        return decode_image(f.read())
+
+
+def prepare_model_input(gray, target_size=(256, 256), out=None):
+    """Resize and normalise a uint8 slice straight into a (1, H, W, 1) float32 tensor."""
+    if target_size is not None and (gray.shape[1], gray.shape[0]) != tuple(target_size):
+        # Same interpolation as cv2.resize in the training notebook
+        gray = cv2.resize(gray, tuple(target_size), interpolation=cv2.INTER_LINEAR)
+    if out is None:
+        out = np.empty((1,) + gray.shape + (1,), dtype=np.float32)
+    np.multiply(gray, np.float32(1 / 255.0), out=out[0, :, :, 0], casting="unsafe")
+    return out
+
+
+class AuditWriter:
+    """Writes uploads to disk on a background thread, off the request path."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload-audit")
+
+    def save(self, data, filename):
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}_{secure_filename(filename)}")
+        self._executor.submit(self._write, path, data)
+        return path
+
+    def _write(self, path, data):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            print(f"Error saving upload to {path}: {str(e)}")